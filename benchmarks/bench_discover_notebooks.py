@@ -0,0 +1,101 @@
+"""Benchmark discovery of the notebooks on a synthetic tree.
+
+Usage:
+    python benchmarks/bench_discover_notebooks.py [number_of_notebooks ...]
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from nbpipeline.rules import Group, Rule, discover_notebooks   # noqa: E402
+from nbpipeline.utils import cd   # noqa: E402
+
+
+def synthetic_notebook(i, image_size=50_000):
+    return {
+        'cells': [
+            {
+                'cell_type': 'markdown',
+                'metadata': {},
+                'source': [f'# Analysis {i}\n', 'TODO: check the results']
+            },
+            {
+                'cell_type': 'code',
+                'execution_count': 1,
+                'metadata': {'tags': ['inputs']},
+                'outputs': [],
+                'source': [f"table = 'data/{i}/input.csv'"]
+            },
+            {
+                'cell_type': 'code',
+                'execution_count': 2,
+                'metadata': {'tags': ['outputs']},
+                'outputs': [],
+                'source': [f"result = 'data/{i}/output.csv'"]
+            },
+            {
+                'cell_type': 'code',
+                'execution_count': 3,
+                'metadata': {},
+                'outputs': [
+                    {
+                        'output_type': 'display_data',
+                        'data': {'image/png': 'iVBORw0KGgo' * (image_size // 11)},
+                        'metadata': {}
+                    }
+                ],
+                'source': ['plot(table)']
+            }
+        ],
+        'metadata': {'kernelspec': {'name': 'python3'}},
+        'nbformat': 4,
+        'nbformat_minor': 4
+    }
+
+
+def create_tree(root: Path, n, per_directory=50):
+    for i in range(n):
+        directory = root / f'project_{i // (per_directory * 10)}' / f'analyses_{i // per_directory}'
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f'Analysis_{i}.ipynb').write_text(json.dumps(synthetic_notebook(i)))
+    # should be pruned, rather than visited
+    for i in range(n // 10):
+        directory = root / 'node_modules' / f'package_{i}'
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / 'Example.ipynb').write_text(json.dumps(synthetic_notebook(i)))
+
+
+def measure(root: Path, cache: str, jobs: int):
+    Rule.rules = {}
+    Group.groups = {}
+    Rule.setup(cache_dir=root / cache, tmp_dir=root / 'tmp')
+    start = time.perf_counter()
+    with cd(root / 'tree'):
+        result = discover_notebooks(ignored_dirs={'node_modules'}, jobs=jobs)
+    return time.perf_counter() - start, result['rules']
+
+
+def main(sizes):
+    jobs = int(os.environ.get("JOBS", os.cpu_count()))
+    for n in sizes:
+        with TemporaryDirectory() as directory:
+            root = Path(directory)
+            create_tree(root / 'tree', n)
+            print(f'{n} notebooks:')
+            serial_time, serial_rules = measure(root, 'cache_serial', jobs=1)
+            print(f'  serially:              {serial_time:.3f} s')
+            parallel_time, parallel_rules = measure(root, 'cache_parallel', jobs=jobs)
+            print(f'  with {jobs} processes:       {parallel_time:.3f} s ({serial_time / parallel_time:.1f}x faster)')
+            assert [rule.name for rule in serial_rules] == [rule.name for rule in parallel_rules]
+            assert [rule.outputs for rule in serial_rules] == [rule.outputs for rule in parallel_rules]
+            cached_time, _ = measure(root, 'cache_parallel', jobs=jobs)
+            print(f'  nothing changed:       {cached_time:.3f} s')
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [5000])
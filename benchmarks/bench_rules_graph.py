@@ -0,0 +1,109 @@
+"""Benchmark ordering of the rules on synthetic graphs.
+
+Usage:
+    python benchmarks/bench_rules_graph.py [number_of_rules ...]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from networkx import simple_cycles   # noqa: E402
+
+from nbpipeline.graph import RulesGraph, InputOutputNode   # noqa: E402
+from nbpipeline.rules import Rule   # noqa: E402
+
+
+class SyntheticRule(Rule):
+
+    def run(self, use_cache=False) -> int:
+        return 0
+
+    def to_json(self):
+        return {'name': self.name}
+
+    def to_graphiz(self):
+        return self.to_json()
+
+
+class LightInputOutputNode(InputOutputNode):
+
+    def to_json(self):
+        # do not look for files on disk
+        return {'name': self.name}
+
+
+def layered_rules(n, width=100, fan_in=3):
+    """Layers of `width` rules, each consuming outputs of `fan_in` rules from the previous layer"""
+    Rule.rules = {}
+    for i in range(n):
+        layer, position = divmod(i, width)
+        inputs = {
+            f'in_{j}': f'data/{layer - 1}/{(position + j) % width}.csv'
+            for j in range(fan_in)
+        } if layer else {'raw': 'data/raw.csv'}
+        SyntheticRule(
+            f'rule {i}',
+            input=inputs,
+            output={'out': f'data/{layer}/{position}.csv'}
+        )
+    return Rule.rules
+
+
+def legacy_iterate_rules(graph):
+    """The ordering algorithm used before, kept for comparison"""
+    cycles = list(simple_cycles(graph))
+    if any(cycles):
+        raise ValueError(f'Could not construct DAG: cycles detected: {cycles}')
+    rules = {node for node in graph.nodes() if isinstance(node, Rule)}
+    available_inputs = {
+        node
+        for node in graph.nodes()
+        if isinstance(node, InputOutputNode) and len(graph.in_edges(node)) == 0
+    }
+    leads = [
+        rule
+        for rule in rules
+        if not rule.has_inputs or all(input in available_inputs for input, myself in graph.in_edges(rule))
+    ]
+    sort = []
+    while leads:
+        rule = leads.pop(0)
+        if rule in sort:
+            continue
+        if any(input not in available_inputs for input, myself in graph.in_edges(rule)):
+            leads.append(rule)
+            continue
+        rules.remove(rule)
+        sort.append(rule)
+        for myself, output in graph.out_edges(rule):
+            available_inputs.add(output)
+            for itself, next_node in graph.out_edges(output):
+                leads.append(next_node)
+    return sort
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main(sizes):
+    import nbpipeline.graph
+    nbpipeline.graph.InputOutputNode = LightInputOutputNode
+
+    for n in sizes:
+        graph = RulesGraph(layered_rules(n))
+        new_time, new_order = measure(graph.iterate_rules)
+        print(f'{n} rules, {graph.graph.number_of_edges()} edges:')
+        print(f'  in-degree ordering: {new_time:.3f} s')
+        if n <= 20000:
+            old_time, old_order = measure(legacy_iterate_rules, graph.graph)
+            assert len(old_order) == len(new_order)
+            print(f'  legacy ordering:    {old_time:.3f} s ({old_time / new_time:.0f}x slower)')
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [1000, 10000, 50000])
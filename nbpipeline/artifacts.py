@@ -0,0 +1,174 @@
+import os
+import pickle
+import shutil
+import stat
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from .hashing import hash_file
+from .utils import SQLiteStore, atomic_copy, atomic_write
+
+
+Manifest = Dict[str, str]
+
+
+def remove(path: Path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+
+class RestoredFiles(SQLiteStore):
+    """The files restored with hardlinks, with the times these were restored at.
+
+    Hard-linked files share the modification time with the stored objects (and all the other
+    files linked to these), so it cannot be updated; instead, such a file is as new as
+    when it was restored, for as long as it is not modified.
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS restored ('
+        ' path TEXT PRIMARY KEY, inode INTEGER, mtime_ns INTEGER, restored_ns INTEGER'
+        ')'
+    )
+
+    def add(self, path: Path):
+        stat = path.stat()
+        self.connection.execute(
+            'INSERT OR REPLACE INTO restored VALUES (?, ?, ?, ?)',
+            (str(path.absolute()), stat.st_ino, stat.st_mtime_ns, time.time_ns())
+        )
+
+    def modification_time(self, path: Path) -> int:
+        stat = path.stat()
+        row = self.connection.execute(
+            'SELECT inode, mtime_ns, restored_ns FROM restored WHERE path = ?',
+            (str(path.absolute()),)
+        ).fetchone()
+        if row and tuple(row[:2]) == (stat.st_ino, stat.st_mtime_ns):
+            return max(stat.st_mtime_ns, row[2])
+        return stat.st_mtime_ns
+
+
+class ArtifactStore:
+    """Content-addressed store of files produced by the rules.
+
+    Objects are never modified once written, so the store can be shared
+    by multiple machines or CI runners (e.g. on a network drive).
+    The files are restored as copies; hardlinks (if enabled) save the space and time,
+    but the restored files then share the (read-only) objects with the store.
+    Each object is verified before being restored, so that an object modified
+    through a hardlink is never restored.
+    """
+
+    def __init__(self, root: Path, hardlinks=False, restored: RestoredFiles = None):
+        """Args:
+            restored: where to record the files restored with hardlinks (local to the checkout)
+        """
+        self.root = Path(root)
+        self.hardlinks = hardlinks
+        self.restored = restored
+
+    def object_path(self, digest: str) -> Path:
+        # the objects hashed with different algorithms are kept apart
+        algorithm, _, digest = digest.rpartition(':')
+        return self.root / 'objects' / algorithm / digest[:2] / digest[2:]
+
+    def record_path(self, key: str) -> Path:
+        return self.root / 'records' / key[:2] / f'{key}.pickle'
+
+    def store_file(self, path: Path) -> str:
+        digest = hash_file(path)
+        target = self.object_path(digest)
+        if not target.exists():
+            atomic_copy(path, target)
+            # protect from accidental modification of the hard-linked copies
+            target.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        return digest
+
+    def store(self, path: Path) -> Optional[Manifest]:
+        """Store a file or directory, returning a manifest: {relative path: digest}"""
+        path = Path(path)
+        if path.is_file():
+            return {'': self.store_file(path)}
+        if path.is_dir():
+            return {
+                file.relative_to(path).as_posix(): self.store_file(file)
+                for file in sorted(path.rglob('*'))
+                if file.is_file()
+            }
+        return None
+
+    def is_intact(self, digest: str) -> bool:
+        """Whether the object exists and was not modified (e.g. through a hardlink); corrupted objects are removed"""
+        path = self.object_path(digest)
+        if not path.is_file():
+            return False
+        if hash_file(path) != digest:
+            path.unlink()
+            return False
+        return True
+
+    def can_restore(self, manifest: Manifest) -> bool:
+        return all(self.is_intact(digest) for digest in manifest.values())
+
+    def restore(self, path: Path, manifest: Manifest) -> bool:
+        """Restore the files described by the manifest; returns False if any of the objects is missing.
+
+        A directory is restored exactly as stored: the files not in the manifest are removed.
+        """
+        path = Path(path)
+        if not self.can_restore(manifest):
+            return False
+        is_directory = '' not in manifest
+        if is_directory != path.is_dir():
+            remove(path)
+        if is_directory:
+            path.mkdir(parents=True, exist_ok=True)
+            for file in sorted(path.rglob('*'), reverse=True):
+                if not file.is_dir() and file.relative_to(path).as_posix() not in manifest:
+                    file.unlink()
+        for relative_path, digest in manifest.items():
+            target = path / relative_path if relative_path else path
+            if target.is_file() and not target.is_symlink() and hash_file(target) == digest:
+                continue
+            remove(target)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            source = self.object_path(digest)
+            try:
+                if not self.hardlinks:
+                    raise OSError('Hardlinks disabled')
+                os.link(source, target)
+            except OSError:
+                # e.g. the store is on a different file system;
+                # the copy is as new as if the output was just produced
+                atomic_copy(source, target)
+            else:
+                if self.restored:
+                    self.restored.add(target)
+        return True
+
+    def modification_time(self, path: Path) -> int:
+        """Modification time of a file, or the time it was restored at (if restored with a hardlink)"""
+        if self.restored:
+            return self.restored.modification_time(path)
+        return path.stat().st_mtime_ns
+
+    @staticmethod
+    def detach(path: Path):
+        """Replace a hard-linked file with a private, writable copy, before it gets overwritten"""
+        path = Path(path)
+        if path.is_file() and path.stat().st_nlink > 1:
+            atomic_copy(path, path)
+
+    def save_record(self, key: str, record: dict):
+        atomic_write(self.record_path(key), pickle.dumps(record))
+
+    def load_record(self, key: str) -> Optional[dict]:
+        path = self.record_path(key)
+        if not path.exists():
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
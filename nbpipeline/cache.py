@@ -0,0 +1,63 @@
+import json
+from hashlib import sha256
+from pathlib import Path
+from typing import Optional
+
+from .hashing import hash_file
+
+
+def hash_path(path: Path) -> Optional[str]:
+    """Hash the content of a file, or of all files in a directory (None if the path does not exist)"""
+    path = Path(path)
+    if path.is_file():
+        return hash_file(path)
+    if path.is_dir():
+        digest = sha256()
+        for file in sorted(path.rglob('*')):
+            if file.is_file():
+                digest.update(file.relative_to(path).as_posix().encode())
+                digest.update(hash_file(file).encode())
+        return digest.hexdigest()
+    return None
+
+
+def canonical(value):
+    """Represent a (possibly nested) value independently of the dictionaries order"""
+    if isinstance(value, dict):
+        return sorted((repr(key), canonical(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    return repr(value)
+
+
+def notebook_source(notebook: dict) -> str:
+    """Serialize the parts of the notebook which can influence the results of its execution,
+
+    skipping outputs, execution counts and metadata (other than tags and the kernel).
+    """
+    return json.dumps({
+        'kernel': notebook.get('metadata', {}).get('kernelspec', {}).get('name'),
+        'cells': [
+            [
+                cell['cell_type'],
+                ''.join(cell.get('source', '')),
+                cell.get('metadata', {}).get('tags', [])
+            ]
+            for cell in notebook['cells']
+        ]
+    }, sort_keys=True)
+
+
+def cache_key(*parts: str) -> str:
+    digest = sha256()
+    for part in parts:
+        digest.update(part.encode())
+        # separate the parts so that their boundaries are unambiguous
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def environment_fingerprint(command: str) -> str:
+    """Hash the output of a command describing the environment, e.g. `pip freeze`"""
+    from subprocess import check_output
+    return sha256(check_output(command, shell=True)).hexdigest()
@@ -0,0 +1,54 @@
+import os
+import pickle
+from pathlib import Path
+from typing import Optional, Sequence
+
+from .utils import SQLiteStore
+
+
+def stat_files(paths: Sequence[Path]) -> Optional[list]:
+    """The (path, mtime_ns, size) of each file, or None if any of them does not exist"""
+    stats = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stats.append([str(path), stat.st_mtime_ns, stat.st_size])
+    return stats
+
+
+class DefinitionIndex(SQLiteStore):
+    """What was deduced from the notebooks when defining the rules (inputs, outputs, headers, etc.),
+
+    so that loading the pipeline does not need to read the notebooks which did not change.
+    Each entry is valid as long as the notebook and all the notebooks it includes (with `%run`)
+    have the same modification time and size.
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS definitions ('
+        ' key TEXT PRIMARY KEY, files BLOB, definition BLOB'
+        ')'
+    )
+
+    def get(self, key: str) -> Optional[dict]:
+        row = self.connection.execute(
+            'SELECT files, definition FROM definitions WHERE key = ?',
+            (key,)
+        ).fetchone()
+        if not row:
+            return None
+        files = pickle.loads(row[0])
+        if stat_files([path for path, _, _ in files]) != files:
+            return None
+        return pickle.loads(row[1])
+
+    def put(self, key: str, files: list, definition: dict):
+        """Args:
+            files: `stat_files()` of the notebook and its includes, taken before these were read
+        """
+        self.connection.execute(
+            'INSERT OR REPLACE INTO definitions VALUES (?, ?, ?)',
+            (key, pickle.dumps(files), pickle.dumps(definition))
+        )
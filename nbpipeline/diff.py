@@ -0,0 +1,136 @@
+import json
+import os
+import pickle
+from copy import copy
+from functools import lru_cache
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+from .cache import cache_key
+from .execution import papermill_parameter
+from .utils import atomic_write
+
+
+def reference_notebook(path: Path, parameters: dict):
+    """Load the notebook (with its current outputs) and inject the parameters,
+
+    like `papermill --prepare-only` would (but in memory), so that the diff
+    does not show spurious changes in the parameters cell.
+    """
+    from papermill.iorw import load_notebook_node
+    from papermill.parameterize import parameterize_notebook
+
+    notebook = load_notebook_node(str(path))
+    if parameters:
+        notebook = parameterize_notebook(notebook, {
+            name: papermill_parameter(value)
+            for name, value in parameters.items()
+        })
+    return notebook
+
+
+@lru_cache()
+def diff_config():
+    """The configuration of nbdime ignoring metadata and details (e.g. execution counts),
+
+    like `nbdiff` command with `--ignore-metadata --ignore-details` would; this is a copy,
+    so that the global configuration of nbdime is left as it was.
+    """
+    from nbdime.diffing.notebooks import diff_ignore, diff_ignore_keys, notebook_config
+    config = copy(notebook_config)
+    for path in ['/metadata', '/cells/*/metadata', '/cells/*/outputs/*/metadata']:
+        config.differs[path] = diff_ignore
+    for path in ['/cells/*', '/cells/*/outputs/*']:
+        config.differs[path] = diff_ignore_keys(config.differs[path], ('execution_count',))
+    return config
+
+
+def diff_notebooks(reference, executed) -> list:
+    """Compute the diff ignoring metadata and details (e.g. execution counts)"""
+    from nbdime.diffing.generic import diff
+    return diff(reference, executed, path='', config=diff_config())
+
+
+def diff_to_html(reference, diff: list, reference_name: str, executed_name: str) -> str:
+    """Render the diff as text (as `nbdiff` command would) converted to HTML"""
+    from ansi2html import Ansi2HTMLConverter
+    from nbdime.prettyprint import PrettyPrintConfig, pretty_print_notebook_diff
+
+    out = StringIO()
+    config = PrettyPrintConfig(
+        out=out,
+        include=SimpleNamespace(metadata=False, details=False),
+        use_git=False,
+        use_diff=False
+    )
+    pretty_print_notebook_diff(reference_name, executed_name, reference, diff, config)
+    return Ansi2HTMLConverter().convert(out.getvalue())
+
+
+def diff_key(reference, executed, *names: str) -> str:
+    """Hash of everything the diff (and its text representation) depends on;
+
+    the metadata, cell ids and execution counts are ignored (like in the diff itself),
+    as papermill records the execution times there.
+    """
+    def cells(notebook):
+        return json.dumps([
+            {
+                key: value
+                for key, value in cell.items()
+                if key not in {'metadata', 'execution_count', 'id'}
+            }
+            for cell in notebook['cells']
+        ], sort_keys=True)
+
+    return cache_key(cells(reference), cells(executed), *names)
+
+
+class DiffCache:
+    """Pickled diffs, keyed by `diff_key()`;
+
+    once the total size exceeds `max_size` (bytes), the least recently used diffs are removed.
+    """
+
+    def __init__(self, root: Path, max_size=512 * 2 ** 20):
+        self.root = Path(root)
+        self.max_size = max_size
+
+    def path(self, key: str) -> Path:
+        return self.root / f'{key}.pickle'
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+            # mark as recently used
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return result
+
+    def put(self, key: str, result: dict):
+        atomic_write(self.path(key), pickle.dumps(result))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.root.glob('*.pickle'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # removed by another process in the meantime
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,138 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from traceback import print_exc
+from typing import Dict, Sequence
+
+from multiprocessing.util import Finalize
+
+
+class KernelPool:
+    """A pool of pre-started kernels, with the modules from the preload list already imported.
+
+    Each kernel is used for a single notebook only and then shut down (so that no state
+    can leak between the rules), while a replacement is started in the background.
+    """
+
+    def __init__(self, kernel_name='python3', size=1, preload: Sequence[str] = ()):
+        self.kernel_name = kernel_name
+        self.size = size
+        self.preload = preload
+        self.starting = deque()
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        # also called when the worker processes exit (unlike atexit handlers)
+        Finalize(self, self.shutdown, exitpriority=10)
+
+    def start_kernel(self):
+        from jupyter_client.manager import KernelManager
+
+        manager = KernelManager(kernel_name=self.kernel_name)
+        manager.start_kernel()
+        client = manager.client()
+        client.start_channels()
+        try:
+            client.wait_for_ready(timeout=60)
+            if self.preload:
+                client.execute_interactive(
+                    '\n'.join(f'import {module}' for module in self.preload),
+                    timeout=None
+                )
+        finally:
+            client.stop_channels()
+        return manager
+
+    def fill(self):
+        while len(self.starting) < self.size:
+            self.starting.append(self.executor.submit(self.start_kernel))
+
+    def acquire(self):
+        """Take a warm kernel manager from the pool (it should be released after use)"""
+        self.fill()
+        kernel = self.starting.popleft()
+        self.fill()
+        return kernel.result()
+
+    @staticmethod
+    def release(manager):
+        manager.shutdown_kernel(now=True)
+
+    def shutdown(self):
+        while self.starting:
+            kernel = self.starting.popleft()
+            if kernel.cancel():
+                continue
+            try:
+                self.release(kernel.result())
+            except Exception:
+                pass
+        self.executor.shutdown(wait=False)
+
+
+pools: Dict[str, KernelPool] = {}
+
+
+def get_pool(kernel_name: str, size: int, preload: Sequence[str]) -> KernelPool:
+    if kernel_name not in pools:
+        pools[kernel_name] = KernelPool(kernel_name=kernel_name, size=size, preload=preload)
+    return pools[kernel_name]
+
+
+PAPERMILL_CONSTANTS = {'True': True, 'False': False, 'None': None}
+
+
+def papermill_parameter(value):
+    """Convert the value in the same way as `papermill -p name value` would
+
+    (so that the notebooks get the same parameters whether executed in a pool or by papermill command)
+    """
+    value = str(value)
+    if value in PAPERMILL_CONSTANTS:
+        return PAPERMILL_CONSTANTS[value]
+    for convert in [int, float]:
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def execute_notebook(
+    input_path: Path, output_path: Path, parameters: dict, cwd: Path,
+    kernel_name='python3', pool_size=1, preload: Sequence[str] = ()
+) -> int:
+    """Execute notebook with papermill, in a warm kernel from a pool, without spawning papermill process.
+
+    Returns: 0 on success, 1 otherwise (like papermill command)
+    """
+    import papermill
+    from papermill.exceptions import PapermillExecutionError
+
+    pool = get_pool(kernel_name, size=pool_size, preload=preload)
+    manager = pool.acquire()
+    try:
+        client = manager.client()
+        client.start_channels()
+        try:
+            client.wait_for_ready(timeout=60)
+            client.execute_interactive(f"__import__('os').chdir({str(cwd)!r})", timeout=60)
+        finally:
+            client.stop_channels()
+        papermill.execute_notebook(
+            str(input_path),
+            str(output_path),
+            parameters={
+                name: papermill_parameter(value)
+                for name, value in parameters.items()
+            },
+            kernel_name=kernel_name,
+            km=manager
+        )
+        return 0
+    except PapermillExecutionError as e:
+        print(e)
+        return 1
+    except Exception:
+        print_exc()
+        return 1
+    finally:
+        pool.release(manager)
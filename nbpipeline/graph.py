@@ -1,13 +1,12 @@
-from functools import partial
+from collections import defaultdict, deque
 from itertools import zip_longest
 from pathlib import Path
-from typing import List
-from warnings import warn
+from typing import Dict, List, Set
 
-from networkx import DiGraph, simple_cycles
-from pandas import DataFrame, read_csv, read_table, read_excel, read_html, read_json
+from networkx import DiGraph, strongly_connected_components
 
-from .rules import Rule
+from .previews import read_head, render_preview
+from .rules import Rule, Group
 
 
 class Node:
@@ -61,74 +60,240 @@ class InputOutputNode(ArgumentNode):
         self.path = path
         super().__init__(name=path, group=group)
 
-    readers = {
-        'csv': read_csv,
-        'tsv': read_table,
-        'xls': read_excel,
-        'xlsx': read_excel,
-        'html': read_html,
-        'json': read_json,
-        # just read anything as rows, ignore sep
-        'txt': partial(read_table, sep='||||||||')
-    }
-
     @property
     def exists(self):
         return Path(self.path).exists()
 
     @property
-    def head(self) -> DataFrame:
-        if not self.exists:
-            return DataFrame()
-        extension = Path(self.path).suffix
-        if extension in self.readers:
-            read = self.readers[extension]
-            try:
-                return read(self.path, nrows=10)
-            except Exception as e:
-                warn(f'Failed to read file {self.path}: {e}')
-        return DataFrame()
+    def head(self):
+        """The first rows of the file (as a DataFrame)"""
+        return read_head(self.path)
+
+    @property
+    def preview(self) -> str:
+        """The first rows of the file as HTML, from the cache if the file did not change"""
+        if Rule.previews:
+            return Rule.previews.preview(self.path)
+        return render_preview(self.path)
 
     def to_json(self):
         return {
             **super().to_json(),
             **{
                 'type': 'io',
-                'head': self.head.to_html(),
+                'head': self.preview,
                 'exists': self.exists
             }
         }
 
 
 class RulesGraph:
+    """The graph of the rules and their inputs and outputs.
+
+    The structure is built once; the attributes of the nodes (which may be expensive to compute,
+    e.g. previews of the files or diffs of the notebooks) are computed once needed (see `refresh()`),
+    and then only re-computed for the nodes which were marked as changed with `update()`.
+    """
 
     def __init__(self, rules):
 
         graph = DiGraph()
         io_nodes = {}
+        # path: the rule producing it
+        producers: Dict[str, Rule] = {}
+        # path: the rules using it as an input
+        consumers: Dict[str, Set[Rule]] = defaultdict(set)
 
         for rule in rules.values():
             rule_node = rule
-            graph.add_node(rule_node, **rule_node.to_graphiz())
+            graph.add_node(rule_node)
 
             if rule.has_outputs:
                 for output in rule.outputs.values():
                     if output not in io_nodes:
                         output_node = InputOutputNode(output, group=rule.group)
                         io_nodes[output] = output_node
-                        graph.add_node(output_node, **output_node.to_json())
+                        graph.add_node(output_node)
                     output_node = io_nodes[output]
                     graph.add_edge(rule_node, output_node)
+                    producers.setdefault(output, rule)
             if rule.has_inputs:
                 for input in rule.inputs.values():
                     if input not in io_nodes:
                         input_node = InputOutputNode(input, group=rule.group)
                         io_nodes[input] = input_node
-                        graph.add_node(input_node, **input_node.to_json())
+                        graph.add_node(input_node)
                     input_node = io_nodes[input]
                     graph.add_edge(input_node, rule_node)
+                    consumers[input].add(rule)
 
         self.graph = graph
+        self.io_nodes = io_nodes
+        self.rules = rules
+        self.producers = producers
+        self.consumers = consumers
+        # to_json() of each node, for the interactive graph
+        self.nodes_data = {}
+        self.outdated = set(graph.nodes)
+
+    def update(self, rule: Rule):
+        """Mark the rule (e.g. once it was run) and its outputs as changed"""
+        self.outdated.add(rule)
+        for output in rule.outputs.values():
+            self.outdated.add(self.io_nodes[output])
+
+    def refresh(self) -> DiGraph:
+        """Compute the attributes of the nodes which changed (or were never computed)
+
+        Returns: the graph with the attributes of the nodes, e.g. for the static graph
+        """
+        if Rule.previews:
+            # read the files in parallel, so that the nodes below find the previews in the cache
+            Rule.previews.previews({
+                node.path
+                for node in self.outdated
+                if isinstance(node, InputOutputNode)
+            })
+        for node in self.outdated:
+            data = node.to_json()
+            self.nodes_data[node] = data
+            attributes = self.graph.nodes[node]
+            attributes.clear()
+            attributes.update(node.to_graphiz() if isinstance(node, Rule) else data)
+        self.outdated = set()
+        return self.graph
+
+    def to_json(self) -> dict:
+        self.refresh()
+        return {
+            'nodes': [self.nodes_data[node] for node in self.graph.nodes],
+            'edges': [
+                {'from': source.name, 'to': target.name}
+                for source, target in self.graph.edges
+            ]
+        }
+
+    def rule_dependencies(self) -> Dict[Rule, Set[Rule]]:
+        """Map each rule to the rules producing its inputs"""
+        return {
+            rule: {
+                producer
+                for input, myself in self.graph.in_edges(rule)
+                for producer, itself in self.graph.in_edges(input)
+            }
+            for rule in self.graph.nodes()
+            if isinstance(rule, Rule)
+        }
+
+    def reachable_rules(self, starts, upstream=True) -> Set[Rule]:
+        """Find rules upstream (or downstream) of given nodes, including the nodes themselves"""
+        neighbours = self.graph.predecessors if upstream else self.graph.successors
+        visited = set(starts)
+        queue = deque(visited)
+        while queue:
+            node = queue.popleft()
+            for neighbour in neighbours(node):
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    queue.append(neighbour)
+        return {node for node in visited if isinstance(node, Rule)}
+
+    def find_rule(self, name: str) -> Rule:
+        if name not in self.rules:
+            raise ValueError(f'Unknown rule: {name!r}')
+        return self.rules[name]
+
+    def find_target(self, target: str) -> Node:
+        """Find a rule by name, or an input/output by path"""
+        if target in self.rules:
+            return self.rules[target]
+        if target in self.io_nodes:
+            return self.io_nodes[target]
+        raise ValueError(f'Unknown target: {target!r} is neither a rule name nor a path of an input or output')
+
+    def group_rules(self, group_id: str) -> Set[Rule]:
+        """Rules in the group or any of its sub-groups"""
+        if group_id not in Group.groups and all(rule.group != group_id for rule in self.rules.values()):
+            raise ValueError(f'Unknown group: {group_id!r}')
+
+        def belongs(group):
+            while group:
+                if group == group_id:
+                    return True
+                group = Group.groups[group].parent if group in Group.groups else None
+            return False
+
+        return {rule for rule in self.rules.values() if belongs(rule.group)}
+
+    def select_rules(self, targets=(), until=(), groups=()) -> Set[Rule]:
+        """Rules needed to produce the given targets (rules or paths), rules or groups of rules"""
+        starts = {self.find_target(target) for target in targets}
+        starts.update(self.find_rule(name) for name in until)
+        for group_id in groups:
+            starts.update(self.group_rules(group_id))
+        return self.reachable_rules(starts, upstream=True)
+
+    def downstream_rules(self, names) -> Set[Rule]:
+        """Rules with given names and all rules using their outputs (directly or not)"""
+        return self.reachable_rules({self.find_rule(name) for name in names}, upstream=False)
+
+    def outdated_rules(self, forced: Set[Rule] = frozenset()) -> Dict[Rule, str]:
+        """Find the rules which need to be run, comparing modification times of the files (like make does).
+
+        Args:
+            forced: rules which should be considered outdated regardless
+
+        Returns: the reasons for running each of the outdated rules, in the topological order
+        """
+        dependencies = self.rule_dependencies()
+        reasons = {}
+        for rule in self.iterate_rules():
+            reason = 'forced to re-run' if rule in forced else rule.outdated_reason()
+            if reason is None:
+                for dependency in dependencies[rule]:
+                    if dependency in reasons:
+                        reason = f'upstream rule {dependency.name!r} will run'
+                        break
+            if reason is not None:
+                reasons[rule] = reason
+        return reasons
+
+    def find_cycle(self) -> List:
+        """Find the shortest cycle in the graph (or return an empty list if there are none).
+
+        Strongly connected components are found in linear time; then the shortest cycle
+        through each of the nodes of the non-trivial components is found with a breadth-first
+        search restricted to the component (this is quadratic, but only if there are cycles).
+        """
+        shortest = []
+        for component in strongly_connected_components(self.graph):
+            if len(component) == 1:
+                node = next(iter(component))
+                if self.graph.has_edge(node, node):
+                    return [node]
+                continue
+            # in the order of the graph, so that the same cycle is reported each time
+            for start in (node for node in self.graph if node in component):
+                cycle = self.shortest_cycle_through(start, component)
+                if not shortest or len(cycle) < len(shortest):
+                    shortest = cycle
+        return shortest
+
+    def shortest_cycle_through(self, start, component: set) -> List:
+        parents = {}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            for _, successor in self.graph.out_edges(node):
+                if successor == start:
+                    cycle = [node]
+                    while cycle[-1] != start:
+                        cycle.append(parents[cycle[-1]])
+                    return cycle[::-1]
+                if successor in component and successor not in parents:
+                    parents[successor] = node
+                    queue.append(successor)
+        return []
 
     def iterate_rules(self, verbose=False) -> List[Rule]:
         """Order rules (tasks) in an order allowing for sequential execution,
@@ -138,77 +303,42 @@ class RulesGraph:
         are outputs of previously run tasks, or just inputs
         which do not depend on any other tasks)
         """
+        dependencies = self.rule_dependencies()
 
-        cycles = list(simple_cycles(self.graph))
-        if any(cycles):
-            for n in cycles[0]:
-                if hasattr(n, 'inputs'):
-                    print(n.inputs)
-                if hasattr(n, 'outputs'):
-                    print(n.outputs)
-            raise ValueError(f'Could not construct DAG: cycles detected: {cycles}')
-
-        rules = {
-            node
-            for node in self.graph.nodes()
-            if isinstance(node, Rule)
-        }
+        waiting_for = {}
+        dependants = defaultdict(list)
+        for rule, rule_dependencies in dependencies.items():
+            waiting_for[rule] = len(rule_dependencies)
+            for dependency in rule_dependencies:
+                dependants[dependency].append(rule)
 
-        available_inputs = {
-            node
-            for node in self.graph.nodes()
-            if isinstance(node, InputOutputNode) and len(self.graph.in_edges(node)) == 0
-        }
+        leads = deque(rule for rule, count in waiting_for.items() if count == 0)
 
-        roots = {
-            rule
-            for rule in rules
-            # no inputs, or all inputs are available from start (do not relay on other rules)
-            if not rule.has_inputs or all(
-                input in available_inputs
-                for input, myself in self.graph.in_edges(rule)
-            )
-        }
+        if verbose:
+            print(f'Starting with: {list(leads)}')
 
         sort = []
 
-        leads = list(roots)
-
-        if verbose:
-            print(f'Starting with: {leads}')
-            print(f'Inputs available to start with: {available_inputs}')
-
         while leads:
-            rule = leads.pop(0)
-            if rule in sort:
-                continue
-            if any(input not in available_inputs for input, myself in self.graph.in_edges(rule)):
-                # cannot process just yet (some input is missing), move to the back of the queue
-                if verbose:
-                    print(f'cannot process {rule} just yet (some input is missing), moving it to the back of the queue')
-                leads.append(rule)
-                continue
-
+            rule = leads.popleft()
             if verbose:
                 print(f'processing {rule}')
-            # mark as visited
-            rules.remove(rule)
             sort.append(rule)
 
-            # add outputs
-            for myself, output in self.graph.out_edges(rule):
-                assert rule == myself
-                if verbose:
-                    print(f'got output: {output} ')
-                available_inputs.add(output)
-                # and start thinking about tasks which can be accomplished using these outputs
-                for itself, next_node in self.graph.out_edges(output):
-                    assert itself == output
-                    assert isinstance(next_node, Rule)
+            # start thinking about tasks which can be accomplished using the outputs of this rule
+            for next_rule in dependants[rule]:
+                waiting_for[next_rule] -= 1
+                if waiting_for[next_rule] == 0:
                     if verbose:
-                        print(f'adding {next_node} to consider later')
-                    leads.append(next_node)
-
-        assert not rules
+                        print(f'all inputs of {next_rule} are now available')
+                    leads.append(next_rule)
+
+        if len(sort) != len(dependencies):
+            cycle = self.find_cycle()
+            description = ' -> '.join(
+                node.name if isinstance(node, Rule) else repr(node.name)
+                for node in cycle + cycle[:1]
+            )
+            raise ValueError(f'Could not construct DAG: cycle detected: {description}')
 
         return sort
@@ -0,0 +1,77 @@
+import mmap
+from hashlib import blake2b
+from pathlib import Path
+from typing import Optional
+
+try:
+    from xxhash import xxh3_128 as hash_function
+except ImportError:
+    hash_function = blake2b
+
+from .utils import SQLiteStore
+
+
+# part of each digest returned by `hash_file`, so that the digests computed with different
+# algorithms (on machines with and without xxhash) are never mistaken for each other
+ALGORITHM = hash_function.__name__
+
+
+def hash_content(path: Path, chunk_size=2 ** 20) -> str:
+    """Hash content of a file without spawning a subprocess;
+
+    files are memory-mapped (falling back to reading in chunks if that is not possible).
+    """
+    digest = hash_function()
+    with open(path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        except (ValueError, OSError):
+            # empty files cannot be mapped, neither can some special files
+            f.seek(0)
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashIndex(SQLiteStore):
+    """The hashes of the files, computed again only once the inode, size or mtime of a file changes"""
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS hashes ('
+        ' path TEXT, algorithm TEXT, inode INTEGER, size INTEGER, mtime_ns INTEGER, digest TEXT,'
+        ' PRIMARY KEY (path, algorithm)'
+        ')'
+    )
+
+    def hash(self, path: Path) -> str:
+        path = Path(path).absolute()
+        stat = path.stat()
+        key = (str(path), ALGORITHM)
+        row = self.connection.execute(
+            'SELECT inode, size, mtime_ns, digest FROM hashes WHERE path = ? AND algorithm = ?',
+            key
+        ).fetchone()
+        if row and tuple(row[:3]) == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            return row[3]
+        digest = hash_content(path)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)',
+            (*key, stat.st_ino, stat.st_size, stat.st_mtime_ns, digest)
+        )
+        return digest
+
+
+index: Optional[HashIndex] = None
+
+
+def use_index(path: Optional[Path]):
+    """Set the location of the index used by `hash_file` (or disable it with None)"""
+    global index
+    index = HashIndex(path) if path else None
+
+
+def hash_file(path: Path) -> str:
+    """Digest of the content of a file, prefixed with the name of the algorithm (e.g. blake2b:...)"""
+    digest = index.hash(path) if index is not None else hash_content(path)
+    return f'{ALGORITHM}:{digest}'
@@ -0,0 +1,66 @@
+import os
+from base64 import b64decode
+from hashlib import sha256
+from pathlib import Path
+from string import hexdigits
+
+from PIL import Image
+
+from .utils import atomic_copy, atomic_write, temporary_path
+
+
+DIGEST_LENGTH = sha256().digest_size * 2
+
+
+class ImageStore:
+    """Content-addressed store of the images from the outputs of the notebooks.
+
+    Each image is written once (no matter how many rules or runs it appears in),
+    together with its thumbnail; the reports refer to the images by their hashes.
+    The thumbnails of the images which Pillow cannot read are the images themselves.
+    """
+
+    def __init__(self, root: Path, thumbnail_size=(92, 92)):
+        self.root = Path(root)
+        self.thumbnail_size = thumbnail_size
+
+    def image_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / f'{digest}.png'
+
+    def thumbnail_path(self, digest: str) -> Path:
+        return self.root / 'thumbnails' / digest[:2] / f'{digest}.png'
+
+    @staticmethod
+    def is_digest(value: str) -> bool:
+        return len(value) == DIGEST_LENGTH and all(character in hexdigits for character in value)
+
+    def has(self, digest: str) -> bool:
+        return self.image_path(digest).exists()
+
+    def store(self, image: str) -> str:
+        """Store a base64-encoded PNG image, returning its digest"""
+        return self.store_data(b64decode(image))
+
+    def store_data(self, data: bytes) -> str:
+        digest = sha256(data).hexdigest()
+        path = self.image_path(digest)
+        if not path.exists():
+            atomic_write(path, data)
+        thumbnail = self.thumbnail_path(digest)
+        if not thumbnail.exists():
+            self.create_thumbnail(path, thumbnail)
+        return digest
+
+    def create_thumbnail(self, path: Path, thumbnail: Path):
+        temporary = temporary_path(thumbnail)
+        try:
+            with Image.open(path) as image:
+                image.thumbnail(self.thumbnail_size)
+                image.save(temporary, format='PNG')
+            os.replace(temporary, thumbnail)
+            return
+        except OSError:
+            # not an image Pillow could read
+            pass
+        # use the image itself
+        atomic_copy(path, thumbnail)
@@ -0,0 +1,120 @@
+import json
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Set
+
+from .cache import hash_path
+from .graph import RulesGraph
+from .rules import Rule
+
+
+class Journal:
+    """Append-only log of the execution of the rules, allowing to resume interrupted runs.
+
+    Each line is a JSON object describing an event: the start of a run,
+    or the start or finish of a rule (with its status and hashes of its outputs).
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.file = None
+
+    def read(self) -> List[dict]:
+        """Read the events of the last run (and of all the runs it resumed)"""
+        if not self.path.exists():
+            return []
+        events = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line could have been partially written when the run was killed
+                    continue
+                if event['event'] == 'run' and not event['resume']:
+                    events = []
+                events.append(event)
+        return events
+
+    @staticmethod
+    def outputs_hashes(rule: Rule) -> Dict[str, str]:
+        return {
+            output: hash_path(rule.resolve(output))
+            for output in rule.outputs.values()
+        }
+
+    @staticmethod
+    def fingerprint(rule: Rule):
+        return rule.cache_key() if hasattr(rule, 'cache_key') else None
+
+    def completed_rules(self, rules: Dict[str, Rule]) -> Dict[Rule, dict]:
+        """Find the rules which succeeded in the last run and did not change since then
+
+        (neither their outputs, nor the notebook or inputs, if these are tracked by the rule).
+        """
+        finished = {}
+        for event in self.read():
+            if event['event'] == 'finished' and event['rule'] in rules:
+                finished[event['rule']] = event
+        return {
+            rules[name]: event
+            for name, event in finished.items()
+            if (
+                event['status'] == 0
+                and event['outputs'] == self.outputs_hashes(rules[name])
+                and event['fingerprint'] == self.fingerprint(rules[name])
+            )
+        }
+
+    def resumable_rules(
+        self, graph: RulesGraph, to_run: Iterable[Rule] = None, forced: Set[Rule] = frozenset()
+    ) -> Dict[Rule, dict]:
+        """The completed rules (see `completed_rules()`) which do not need to be run again when resuming
+
+        Args:
+            graph: the graph of the rules
+            to_run: the rules to be run, if not all
+            forced: rules which have to be run again regardless
+
+        The rules downstream of any rule which will be run (again) are excluded, as their inputs will change.
+        """
+        completed = self.completed_rules(graph.rules)
+        will_run = {
+            rule
+            for rule in (graph.rules.values() if to_run is None else to_run)
+            if rule not in completed or rule in forced
+        }
+        outdated = graph.reachable_rules(will_run, upstream=False)
+        return {
+            rule: event
+            for rule, event in completed.items()
+            if rule not in outdated
+        }
+
+    def write(self, event: str, **data):
+        self.file.write(json.dumps({'event': event, 'time': time.time(), **data}) + '\n')
+        self.file.flush()
+
+    def start_run(self, resume=False):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # the events from before the last (not resumed) run are no longer useful
+        self.file = open(self.path, 'a' if resume else 'w')
+        self.write('run', resume=resume)
+
+    def started(self, rule: Rule):
+        self.write('started', rule=rule.name)
+
+    def finished(self, rule: Rule, status: int):
+        self.write(
+            'finished',
+            rule=rule.name,
+            status=status,
+            execution_time=rule.execution_time,
+            outputs=self.outputs_hashes(rule) if status == 0 else {},
+            fingerprint=self.fingerprint(rule) if status == 0 else None
+        )
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
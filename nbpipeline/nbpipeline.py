@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 import os
 from argparse import FileType
-from contextlib import ExitStack
 from os import system
 from importlib.util import spec_from_file_location, module_from_spec
 from pathlib import Path
@@ -9,13 +8,15 @@ from tempfile import gettempdir
 
 from declarative_parser import Argument
 from declarative_parser.constructor_parser import ConstructorParser
-from networkx import DiGraph
 
-from .utils import cd
+from .cache import environment_fingerprint
 from .version_control.git import infer_repository_url
 from .graph import RulesGraph
+from .journal import Journal
 from .rules import Rule
+from .scheduler import Scheduler
 from .visualization.interactive_graph import generate_graph
+from .visualization.layout import LayoutCache
 from .visualization.static_graph import static_graph
 
 
@@ -62,6 +63,18 @@ class Pipeline:
         short='S'
     )
 
+    chunked_report = Argument(
+        action='store_true',
+        help='Write the details of the nodes of the interactive graph (diffs, images, previews) to separate files'
+             ' next to the report, loaded only once needed; recommended for large pipelines.'
+    )
+
+    precomputed_layout = Argument(
+        action='store_true',
+        help='Lay the interactive graph out with graphviz (once for each structure of the graph, then cached),'
+             ' rather than in the browser each time the report is opened; recommended for large pipelines.'
+    )
+
     graph_width = Argument(
         type=int,
         short='w',
@@ -100,11 +113,32 @@ class Pipeline:
         short='d'
     )
 
+    environment_fingerprint = Argument(
+        type=str,
+        default=None,
+        help='A command describing the environment, e.g. "pip freeze"; its output will be included in the cache key'
+             ' so that the cached results are not reused once the environment changes.'
+    )
+
     cache_dir = Argument(
         type=str,
         default='.nbpipeline_cache'
     )
 
+    artifacts_dir = Argument(
+        type=str,
+        default=None,
+        help='Where to store the files produced by the rules, so that they can be restored from cache'
+             ' (instead of re-running the rules); can be shared by multiple machines.'
+             ' By default the files are not stored, as this takes as much space as the outputs themselves.'
+    )
+
+    use_hardlinks = Argument(
+        action='store_true',
+        help='Restore the files from the artifacts store with hardlinks (if possible) rather than copies;'
+             ' saves space, but the restored files are read-only (nbpipeline replaces these before re-running a rule)'
+    )
+
     tmp_dir = Argument(
         type=str,
         default=os.path.join(gettempdir(), 'nbpipeline', Path.cwd().name)
@@ -131,6 +165,82 @@ class Pipeline:
         action='store_true'
     )
 
+    skip_up_to_date = Argument(
+        action='store_true',
+        help='Skip the rules whose outputs exist and are newer than their notebooks and inputs (like make),'
+             ' without computing hashes; with --dry_run, show why the other rules would be run.'
+    )
+
+    target = Argument(
+        nargs='+',
+        default=[],
+        help='Only run the rules needed to produce given outputs (paths) or rules (names)'
+    )
+
+    until = Argument(
+        nargs='+',
+        default=[],
+        help='Only run given rules (names), and the rules producing their inputs'
+    )
+
+    group = Argument(
+        nargs='+',
+        default=[],
+        help='Only run the rules from given groups (ids), and the rules producing their inputs'
+    )
+
+    rerun_from = Argument(
+        nargs='+',
+        default=[],
+        help='Force re-running given rules (names), and all the rules downstream of them, ignoring the cache'
+    )
+
+    fail_fast = Argument(
+        action='store_true',
+        help='Do not start any new rules once any of the rules failed'
+             ' (by default only the rules downstream of the failed rule are skipped).'
+    )
+
+    resume = Argument(
+        action='store_true',
+        help='Continue the last (interrupted) run, skipping the rules which completed successfully'
+             ' (unless their notebooks, inputs or outputs changed since).'
+    )
+
+    kernel_pool = Argument(
+        type=int,
+        default=0,
+        help='Execute notebooks in-process using a pool of pre-started kernels of given size'
+             ' (in each worker process), rather than running papermill command for each notebook;'
+             ' each kernel is used for a single notebook only.'
+    )
+
+    preload = Argument(
+        nargs='+',
+        default=[],
+        help='Modules to import in the kernels of the pool, e.g. pandas numpy'
+    )
+
+    defer_diffs = Argument(
+        action='store_true',
+        help='Compute the reproducibility diffs in background worker processes (or once the report is generated),'
+             ' so that the downstream rules can start as soon as the notebook was executed.'
+    )
+
+    diff_cache_size = Argument(
+        type=int,
+        default=512,
+        help='The maximal size (in MB) of the cache of the reproducibility diffs (least recently used diffs'
+             ' are removed first); 0 to disable'
+    )
+
+    jobs = Argument(
+        type=int,
+        default=1,
+        help='The maximal number of rules to run in parallel (each in a separate worker process);'
+             ' also the number of processes reading the notebooks found by discover_notebooks()'
+    )
+
     def display(self, path):
         browser = self.display_graph_with
 
@@ -147,16 +257,20 @@ class Pipeline:
 
     def export_svg(self, rules_dag, path, options):
 
-        graph_svg = static_graph(rules_dag, options)
+        graph_svg = static_graph(rules_dag, options, cache_dir=self.cache_dir / 'static_graph')
 
         with open(path, 'w') as f:
             f.write(graph_svg)
 
         self.display(path)
 
-    def export_interactive_graph(self, rules_dag: DiGraph, path):
+    def export_interactive_graph(self, rules_graph: RulesGraph, path):
 
-        graph_html = generate_graph(rules_dag, **self.parameters)
+        details_dir = Path(path).with_name(Path(path).stem + '_details') if self.chunked_report else None
+        layouts = LayoutCache(self.cache_dir / 'layouts') if self.precomputed_layout else None
+        graph_html = generate_graph(
+            rules_graph, details_dir=details_dir, layouts=layouts, report_path=path, **self.parameters
+        )
 
         with open(path, 'w') as f:
             f.write(graph_html)
@@ -173,7 +287,22 @@ class Pipeline:
         self.tmp_dir = Path(self.tmp_dir)
         self.cache_dir = Path(self.cache_dir)
 
-        Rule.setup(tmp_dir=self.tmp_dir, cache_dir=self.cache_dir)
+        Rule.setup(
+            tmp_dir=self.tmp_dir,
+            cache_dir=self.cache_dir,
+            artifacts_dir=self.artifacts_dir,
+            hardlinks=self.use_hardlinks,
+            kernel_pool=self.kernel_pool,
+            preload=self.preload,
+            defer_diffs=self.defer_diffs,
+            diff_cache_size=self.diff_cache_size * 2 ** 20,
+            jobs=self.jobs,
+            environment=(
+                environment_fingerprint(self.environment_fingerprint)
+                if self.environment_fingerprint else
+                None
+            )
+        )
 
         self.tmp_dir.mkdir(exist_ok=True, parents=True)
         self.cache_dir.mkdir(exist_ok=True, parents=True)
@@ -196,30 +325,77 @@ class Pipeline:
 
         if not self.just_plot_the_last_graph:
 
-            for node in graph.iterate_rules():
-
-                if self.dry_run:
-                    print(node)
-                else:
-                    if not self.do_not_make_output_dirs and hasattr(node, 'maybe_create_output_dirs'):
-                        node.maybe_create_output_dirs()
-                    with ExitStack() as stack:
-                        if not self.run_from_root and hasattr(node, 'notebook'):
-                            stack.enter_context(cd(Path(node.notebook).parent))
-
-                        status = node.run(use_cache=not self.disable_cache)
-
-                    if status != 0:
-                        all_success = False
-
-        dag = RulesGraph(rules).graph
+            to_run = None
+
+            if self.target or self.until or self.group:
+                to_run = graph.select_rules(targets=self.target, until=self.until, groups=self.group)
+
+            forced = graph.downstream_rules(self.rerun_from)
+
+            if self.skip_up_to_date:
+                to_run = {
+                    rule: reason
+                    for rule, reason in graph.outdated_rules(forced=forced).items()
+                    if to_run is None or rule in to_run
+                }
+
+            journal = Journal(self.cache_dir / 'journal.jsonl')
+
+            if self.resume:
+                completed = journal.resumable_rules(graph, to_run=to_run, forced=forced)
+                for rule, event in completed.items():
+                    # the fingerprint is the cache key of the results of the completed run
+                    if event['fingerprint']:
+                        rule.load_results(event['fingerprint'])
+                    rule.status = 0
+                    rule.execution_time = event['execution_time']
+                    graph.update(rule)
+                print(f'Resuming the previous run: {len(completed)} rules were already completed')
+                to_run = {
+                    rule: to_run[rule] if isinstance(to_run, dict) else None
+                    for rule in (rules.values() if to_run is None else to_run)
+                    if rule not in completed or rule in forced
+                }
+
+            if self.dry_run:
+                for node in graph.iterate_rules():
+                    if to_run is None or node in to_run:
+                        reason = to_run.get(node) if isinstance(to_run, dict) else None
+                        print(f'{node}: {reason}' if reason else node)
+            else:
+                if to_run is not None:
+                    print(f'{len(rules) - len(to_run)} rules will not be run')
+                scheduler = Scheduler(
+                    graph,
+                    rules=to_run,
+                    forced=forced,
+                    fail_fast=self.fail_fast,
+                    journal=journal,
+                    jobs=self.jobs,
+                    use_cache=not self.disable_cache,
+                    run_from_root=self.run_from_root,
+                    make_output_dirs=not self.do_not_make_output_dirs
+                )
+                journal.start_run(resume=self.resume)
+                try:
+                    statuses = scheduler.run()
+                finally:
+                    journal.close()
+                all_success = all(status == 0 for status in statuses.values())
+
+        if self.interactive_graph or self.static_graph:
+            # the diffs which were deferred (and not computed in the background) are needed for the report
+            for rule in rules.values():
+                if getattr(rule, 'pending_diff', None):
+                    rule.compute_pending_diff()
+                    graph.update(rule)
 
         if self.interactive_graph:
             # TODO add an option to create standalone files by inlining all the css and js dependencies
-            self.export_interactive_graph(dag, path=str(self.tmp_dir / 'graph.html'))
+            self.export_interactive_graph(graph, path=str(self.tmp_dir / 'graph.html'))
 
         if self.static_graph:
-            self.export_svg(dag, path=str(self.tmp_dir / 'graph.svg'), options=self.static_graph_options)
+            self.export_svg(graph.refresh(), path=str(self.tmp_dir / 'graph.svg'), options=self.static_graph_options)
 
         self.status = 0 if all_success else 1
 
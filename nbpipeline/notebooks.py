@@ -0,0 +1,283 @@
+import json
+import mmap
+import os
+import re
+from copy import copy
+from pathlib import Path
+
+from .definitions import stat_files
+
+# cells tagged with these may define their inputs/outputs in the metadata of their outputs
+IO_TAGS = frozenset({'inputs', 'outputs'})
+
+_whitespace = re.compile(rb'[ \t\n\r]*')
+_structure = re.compile(rb'[\[\]{}"]')
+_scalar = re.compile(rb'[^,\]}\s]+')
+
+
+class Scanner:
+    """Walks through a JSON document, decoding only the values which were asked for;
+
+    the skipped values (e.g. outputs of the cells) are never turned into Python objects.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.position = 0
+
+    def error(self, message):
+        return ValueError(f'{message} at position {self.position}')
+
+    def peek(self) -> bytes:
+        self.position = _whitespace.match(self.buffer, self.position).end()
+        return self.buffer[self.position:self.position + 1]
+
+    def consume(self, expected: bytes):
+        if self.peek() != expected:
+            raise self.error(f'Expected {expected!r}')
+        self.position += 1
+
+    def string_end(self, start: int) -> int:
+        # searching for the closing quote is much faster than matching long strings (e.g. images) with a regex
+        end = start
+        while True:
+            end = self.buffer.find(b'"', end + 1)
+            if end == -1:
+                raise self.error('Unterminated string')
+            backslashes = 0
+            while self.buffer[end - 1 - backslashes] == ord('\\'):
+                backslashes += 1
+            if backslashes % 2 == 0:
+                return end + 1
+
+    def skip(self) -> slice:
+        """Skip over a value, returning where it was"""
+        start = self.position = _whitespace.match(self.buffer, self.position).end()
+        first = self.buffer[start:start + 1]
+        if first == b'"':
+            self.position = self.string_end(start)
+        elif first in (b'[', b'{'):
+            depth = 0
+            while True:
+                match = _structure.search(self.buffer, self.position)
+                if not match:
+                    raise self.error('Unterminated value')
+                token = match.group()
+                if token == b'"':
+                    self.position = self.string_end(match.start())
+                    continue
+                depth += 1 if token in (b'[', b'{') else -1
+                self.position = match.end()
+                if depth == 0:
+                    break
+        else:
+            match = _scalar.match(self.buffer, start)
+            if not match:
+                raise self.error('Expected a value')
+            self.position = match.end()
+        return slice(start, self.position)
+
+    def decode(self):
+        return json.loads(self.buffer[self.skip()])
+
+    def _separated(self, opening: bytes, closing: bytes):
+        self.consume(opening)
+        if self.peek() == closing:
+            self.position += 1
+            return
+        while True:
+            yield
+            if self.peek() == b',':
+                self.position += 1
+                continue
+            self.consume(closing)
+            return
+
+    def keys(self):
+        """Iterate over the keys of an object; the value has to be decoded or skipped before the next key"""
+        for _ in self._separated(b'{', b'}'):
+            key = self.decode()
+            self.consume(b':')
+            yield key
+
+    def items(self):
+        """Iterate over an array; each item has to be decoded or skipped before the next one"""
+        for index, _ in enumerate(self._separated(b'[', b']')):
+            yield index
+
+
+def _outputs_metadata(scanner: Scanner) -> list:
+    outputs = []
+    for _ in scanner.items():
+        output = {}
+        for key in scanner.keys():
+            if key in {'output_type', 'metadata'}:
+                output[key] = scanner.decode()
+            else:
+                scanner.skip()
+        outputs.append(output)
+    return outputs
+
+
+def _scan_outline(scanner: Scanner, tags) -> dict:
+    notebook = {}
+    for key in scanner.keys():
+        if key != 'cells':
+            notebook[key] = scanner.decode()
+            continue
+        cells = notebook['cells'] = []
+        for _ in scanner.items():
+            cell = {}
+            for cell_key in scanner.keys():
+                if cell_key != 'outputs':
+                    cell[cell_key] = scanner.decode()
+                elif 'metadata' in cell and not tags.intersection(cell['metadata'].get('tags', [])):
+                    scanner.skip()
+                else:
+                    # the metadata may come after the outputs (if not written by Jupyter)
+                    cell['outputs'] = _outputs_metadata(scanner)
+            if 'outputs' in cell and not tags.intersection(cell.get('metadata', {}).get('tags', [])):
+                del cell['outputs']
+            cells.append(cell)
+    return notebook
+
+
+def read_outline(path: Path, tags=IO_TAGS) -> dict:
+    """Read the notebook without the outputs of its cells (which can be huge, e.g. images);
+
+    only the cells tagged with one of `tags` keep their outputs, reduced to `output_type` and `metadata`.
+    The file is memory-mapped, so it is never loaded into memory as a whole.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files cannot be mapped
+            raise ValueError(f'{path} is empty')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return _scan_outline(Scanner(mapped), tags)
+
+
+def read_images(path: Path, mime_type='image/png'):
+    """Iterate over the (base64-encoded) images in the outputs of the notebook, decoding only these"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f'{path} is empty')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            scanner = Scanner(mapped)
+            for key in scanner.keys():
+                if key != 'cells':
+                    scanner.skip()
+                    continue
+                for _ in scanner.items():
+                    for cell_key in scanner.keys():
+                        if cell_key != 'outputs':
+                            scanner.skip()
+                            continue
+                        for _ in scanner.items():
+                            for output_key in scanner.keys():
+                                if output_key != 'data':
+                                    scanner.skip()
+                                    continue
+                                for data_type in scanner.keys():
+                                    if data_type == mime_type:
+                                        yield scanner.decode()
+                                    else:
+                                        scanner.skip()
+
+
+def strip_outputs(notebook) -> dict:
+    """Shallow copy of the notebook with the outputs of the code cells removed (the original is not modified)"""
+    return {
+        **notebook,
+        'cells': [
+            {**cell, 'outputs': []} if cell['cell_type'] == 'code' else cell
+            for cell in notebook['cells']
+        ]
+    }
+
+
+def read_notebook(path: Path) -> dict:
+    """Read the whole notebook, including the outputs"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def run_magic_includes(notebook) -> list:
+    """Paths of the notebooks included with `%run` magic"""
+    return [
+        line[5:].strip()
+        for cell in notebook['cells']
+        if cell['cell_type'] == 'code'
+        for line in cell['source']
+        if line.startswith('%run')
+    ]
+
+
+class IncludeResolver:
+    """Replaces `%run` magics with the cells of the included notebooks (recursively).
+
+    Each included notebook is read (with `load`) and expanded only once, and reused for as long as
+    none of the files it consists of changed. The cells are shared between all the notebooks
+    including it, so these have to be copied before being modified.
+    The relative paths are resolved against `root` (by default, the current working directory).
+    """
+
+    def __init__(self, load=read_notebook, root: Path = None):
+        self.load = load
+        self.root = root
+        # absolute path: (`stat_files()` of the notebook and of all notebooks it includes, expanded cells)
+        self.cache = {}
+
+    def resolve(self, path: str) -> str:
+        return os.path.abspath(os.path.join(self.root, path) if self.root else path)
+
+    def included_cells(self, path: str, including=()) -> list:
+        path = self.resolve(path)
+        if path in including:
+            cycle = ' -> '.join(including[including.index(path):] + (path,))
+            raise ValueError(f'Could not expand %run magics: cycle detected: {cycle}')
+        cached = self.cache.get(path)
+        if cached is not None and stat_files([file for file, _, _ in cached[0]]) == cached[0]:
+            return cached[1]
+        # stat before reading, so that changes made in the meantime are not missed
+        files = stat_files([path]) or []
+        notebook = self.load(path)
+        cells = self.expand(notebook, including + (path,))['cells']
+        self.cache[path] = files + self.dependencies(notebook), cells
+        return cells
+
+    def dependencies(self, notebook) -> list:
+        """`stat_files()` of all the notebooks included by the (not yet expanded) notebook, directly or not"""
+        files = []
+        for path in run_magic_includes(notebook):
+            cached = self.cache.get(self.resolve(path))
+            if cached is not None:
+                files.extend(cached[0])
+        return files
+
+    def expand(self, notebook, including=()) -> dict:
+        out_notebook = copy(notebook)
+        new_cells = []
+
+        for cell in notebook['cells']:
+            if cell['cell_type'] != 'code' or not any(line.startswith('%run') for line in cell['source']):
+                new_cells.append(cell)
+                continue
+
+            other_code = []
+            for line in cell['source']:
+                if line.startswith('%run'):
+                    if other_code:
+                        split_cell = copy(cell)
+                        split_cell['source'] = other_code
+                        new_cells.append(split_cell)
+                        other_code = []
+                    new_cells.extend(self.included_cells(line[5:].strip(), including))
+                else:
+                    other_code.append(line)
+            if other_code:
+                split_cell = copy(cell)
+                split_cell['source'] = other_code
+                new_cells.append(split_cell)
+
+        out_notebook['cells'] = new_cells
+        return out_notebook
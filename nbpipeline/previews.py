@@ -0,0 +1,188 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+from warnings import warn
+
+from .utils import SQLiteStore
+
+
+def _truncated(path: Path, max_bytes: int) -> BytesIO:
+    """The beginning of the file, up to the last complete line within `max_bytes`"""
+    with open(path, 'rb') as f:
+        chunk = f.read(max_bytes)
+        if f.read(1):
+            chunk = chunk[:chunk.rfind(b'\n') + 1] or chunk
+    return BytesIO(chunk)
+
+
+def read_delimited(path: Path, rows: int, max_bytes: int, **kwargs):
+    from pandas import read_csv
+    return read_csv(_truncated(path, max_bytes), nrows=rows, **kwargs)
+
+
+def read_tsv(path: Path, rows: int, max_bytes: int):
+    return read_delimited(path, rows, max_bytes, sep='\t')
+
+
+def read_text(path: Path, rows: int, max_bytes: int):
+    from pandas import read_table
+    # just read anything as rows, ignore sep
+    return read_table(_truncated(path, max_bytes), sep='||||||||', nrows=rows, engine='python')
+
+
+def read_excel(path: Path, rows: int, max_bytes: int):
+    from pandas import read_excel
+    return read_excel(path, nrows=rows)
+
+
+def read_html(path: Path, rows: int, max_bytes: int):
+    from pandas import read_html
+    return read_html(str(path))[0].head(rows)
+
+
+def read_json(path: Path, rows: int, max_bytes: int):
+    from pandas import read_json
+    if os.path.getsize(path) <= max_bytes:
+        return read_json(path).head(rows)
+    # only line-delimited files can be read partially
+    return read_json(path, lines=True, nrows=rows)
+
+
+def read_parquet(path: Path, rows: int, max_bytes: int):
+    """Read the schema and the first rows of the first row group only"""
+    from pyarrow.parquet import ParquetFile
+    parquet = ParquetFile(path)
+    if parquet.num_row_groups:
+        for batch in parquet.iter_batches(batch_size=rows, row_groups=[0]):
+            return batch.to_pandas()
+    return parquet.schema_arrow.empty_table().to_pandas()
+
+
+def read_feather(path: Path, rows: int, max_bytes: int):
+    """Read the first record batch of a memory-mapped (version 2) Feather file"""
+    import pyarrow
+    from pyarrow.ipc import open_file
+    with pyarrow.memory_map(str(path)) as source:
+        reader = open_file(source)
+        if reader.num_record_batches == 0:
+            return reader.schema.empty_table().to_pandas()
+        return reader.get_batch(0).slice(0, rows).to_pandas()
+
+
+def read_hdf(path: Path, rows: int, max_bytes: int):
+    """Read the first rows of the first table in the store (whole object for the fixed format)"""
+    from pandas import HDFStore
+    with HDFStore(path, mode='r') as store:
+        key = store.keys()[0]
+        try:
+            return store.select(key, start=0, stop=rows)
+        except TypeError:
+            # fixed format does not support partial reads
+            return store.get(key).head(rows)
+
+
+# by extension (without the dot)
+READERS = {
+    'csv': read_delimited,
+    'tsv': read_tsv,
+    'txt': read_text,
+    'xls': read_excel,
+    'xlsx': read_excel,
+    'html': read_html,
+    'json': read_json,
+    'parquet': read_parquet,
+    'pq': read_parquet,
+    'feather': read_feather,
+    'arrow': read_feather,
+    'h5': read_hdf,
+    'hdf': read_hdf,
+    'hdf5': read_hdf
+}
+
+
+def read_head(path: Path, rows=10, max_bytes=2 ** 20):
+    """Read the first rows of a data file, without reading the whole file if possible
+
+    Returns: a DataFrame, empty if the file does not exist or could not be read
+    """
+    from pandas import DataFrame
+    path = Path(path)
+    if not path.is_file():
+        return DataFrame()
+    read = READERS.get(path.suffix[1:].lower())
+    if read:
+        try:
+            return read(path, rows, max_bytes)
+        except Exception as e:
+            warn(f'Failed to read file {path}: {e}')
+    return DataFrame()
+
+
+def render_preview(path: Path, rows=10, max_bytes=2 ** 20) -> str:
+    return read_head(path, rows=rows, max_bytes=max_bytes).to_html()
+
+
+class PreviewCache(SQLiteStore):
+    """The HTML previews of the data files, rendered again only once the inode, size or mtime of a file changes"""
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS previews ('
+        ' path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, mtime_ns INTEGER, html TEXT'
+        ')'
+    )
+
+    def __init__(self, path: Path, rows=10, max_bytes=2 ** 20, jobs: int = None):
+        super().__init__(path)
+        self.rows = rows
+        self.max_bytes = max_bytes
+        self.jobs = jobs or min(32, (os.cpu_count() or 1) * 4)
+
+    @staticmethod
+    def stat(path: Path) -> Optional[tuple]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def cached(self, path: str, stat: tuple) -> Optional[str]:
+        row = self.connection.execute(
+            'SELECT inode, size, mtime_ns, html FROM previews WHERE path = ?',
+            (path,)
+        ).fetchone()
+        if row and tuple(row[:3]) == stat:
+            return row[3]
+        return None
+
+    def render(self, path: Path) -> str:
+        return render_preview(path, rows=self.rows, max_bytes=self.max_bytes)
+
+    def previews(self, paths: Iterable[Path]) -> Dict[Path, str]:
+        """Previews of multiple files; the files which changed are read in parallel"""
+        previews = {}
+        to_render = {}
+        for path in paths:
+            stat = self.stat(path)
+            key = str(Path(path).absolute())
+            html = self.cached(key, stat) if stat else None
+            if html is None:
+                to_render[path] = key, stat
+            else:
+                previews[path] = html
+        if to_render:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                rendered = pool.map(self.render, to_render)
+                for path, html in zip(to_render, rendered):
+                    previews[path] = html
+                    key, stat = to_render[path]
+                    if stat:
+                        self.connection.execute(
+                            'INSERT OR REPLACE INTO previews VALUES (?, ?, ?, ?, ?)',
+                            (key, *stat, html)
+                        )
+        return previews
+
+    def preview(self, path: Path) -> str:
+        return self.previews([path])[path]
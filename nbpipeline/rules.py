@@ -1,18 +1,32 @@
 import json
 import pickle
 import re
-from copy import copy, deepcopy
-from functools import lru_cache
-from json import JSONDecodeError
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from os import system, walk, sep
+from os.path import relpath
 from abc import ABC, abstractmethod
 from pathlib import Path
 import time
-from subprocess import check_output
-from tempfile import NamedTemporaryFile
-from warnings import warn
+from typing import Dict, Optional, Sequence
+from warnings import catch_warnings, simplefilter, warn
 
-from .utils import subset_dict_preserving_order, run_command, nice_time
+from .artifacts import ArtifactStore, RestoredFiles
+from .cache import cache_key, canonical, hash_path, notebook_source
+from .definitions import DefinitionIndex, stat_files
+from .diff import DiffCache, reference_notebook, diff_key, diff_notebooks, diff_to_html
+from .execution import execute_notebook
+from .hashing import use_index
+from .images import ImageStore
+from .notebooks import IncludeResolver, read_images, read_notebook, read_outline, strip_outputs
+from .previews import PreviewCache
+from .utils import subset_dict_preserving_order, nice_time, modification_time
+from .version_control.git import Repository
+
+
+# status of the rules which were not run because a rule producing their inputs failed
+SKIPPED = 'skipped'
 
 
 class no_quotes(str):
@@ -34,6 +48,19 @@ class Rule(ABC):
 
     cache_dir: Path
     tmp_dir: Path
+    root_dir: Path
+    environment: str = None
+    artifacts: ArtifactStore = None
+    kernel_pool = 0
+    preload = ()
+    defer_diffs = False
+    jobs = 1
+    diff_cache: DiffCache = None
+    definitions: DefinitionIndex = None
+    repository: Repository = None
+    image_store: ImageStore = None
+    previews: PreviewCache = None
+    settings = {}
     is_setup = False
     rules = {}
 
@@ -56,6 +83,9 @@ class Rule(ABC):
         assert name not in self.rules
         self.name = name
         self.execution_time = None
+        self.status = None
+        # name of the failed upstream rule
+        self.skipped_because = None
         self.rules[name] = self
         extra_kwargs = set(kwargs) - {'output', 'input', 'group', 'parameters'}
         if extra_kwargs:
@@ -88,17 +118,118 @@ class Rule(ABC):
     def has_outputs(self):
         return len(self.outputs) != 0
 
+    @property
+    def sources(self) -> Dict[str, Path]:
+        """Files (other than the inputs) defining what the rule does, e.g. {'notebook': path}"""
+        return {}
+
+    def outdated_reason(self) -> Optional[str]:
+        """Why the rule needs to be run, judging by the modification times of its files (like make does).
+
+        Returns: None if all the outputs exist and are newer than the sources and all the inputs
+        """
+        if not self.has_outputs:
+            return 'no outputs'
+        # the files restored from the artifacts store with hardlinks are as new as when restored
+        file_time = self.artifacts.modification_time if self.artifacts else None
+        oldest_output = None
+        for output in self.outputs.values():
+            path = self.resolve(output)
+            if not path.exists():
+                return f'missing output {output}'
+            output_time = modification_time(path, newest=False, file_time=file_time)
+            if oldest_output is None or output_time < oldest_output:
+                oldest_output = output_time
+        for kind, path in self.sources.items():
+            if modification_time(path) > oldest_output:
+                return f'changed {kind}'
+        for input in self.inputs.values():
+            path = self.resolve(input)
+            if path.exists() and modification_time(path, file_time=file_time) > oldest_output:
+                return f'newer input {input}'
+        return None
+
+    def load_results(self, key: str) -> bool:
+        """Load the results (diffs, images, etc.) of a previous run with given cache key, if the rule keeps any
+
+        Returns: False if these could not be found
+        """
+        return False
+
     @abstractmethod
     def run(self, use_cache: bool) -> int:
         if not self.is_setup:
             raise ValueError('Please set up the rules class settings with Rule.setup() first!')
 
     @classmethod
-    def setup(cls, cache_dir: Path, tmp_dir: Path):
-        cls.cache_dir = Path(cache_dir)
-        cls.tmp_dir = Path(tmp_dir)
+    def setup(
+        cls, cache_dir: Path, tmp_dir: Path, root_dir: Path = None, environment: str = None,
+        artifacts_dir: Path = None, hardlinks=False, kernel_pool: int = 0, preload: Sequence[str] = (),
+        defer_diffs=False, diff_cache_size: int = 512 * 2 ** 20, jobs: int = 1
+    ):
+        """
+        Args:
+            cache_dir: where to store the results of previous runs
+            tmp_dir: where to store the intermediate files
+            root_dir: the directory which paths of inputs and outputs are relative to;
+                by default the current working directory
+            environment: a fingerprint of the environment to be included in the cache keys
+            artifacts_dir: where to store the files produced by the rules (so that these can be restored
+                from cache); by default (or if 'none') the files are not stored
+            hardlinks: whether to restore the files from the artifacts store using hardlinks (if possible),
+                rather than copies; the restored files are then read-only
+            kernel_pool: how many warm kernels to keep in each process to execute the notebooks without
+                starting papermill processes; if 0, papermill command will be used instead
+            preload: modules to import in the warm kernels
+            defer_diffs: do not compute the diffs right after the notebooks are executed,
+                but leave them to be computed in the background (or once needed)
+            diff_cache_size: the maximal size (in bytes) of the cache of the diffs; 0 to disable
+            jobs: the number of processes to use, e.g. to read the notebooks in `discover_notebooks()`
+        """
+        cls.cache_dir = Path(cache_dir).absolute()
+        cls.tmp_dir = Path(tmp_dir).absolute()
+        cls.root_dir = Path(root_dir or Path.cwd()).absolute()
+        cls.environment = environment
+        use_index(cls.cache_dir / 'hashes.sqlite')
+        cls.definitions = DefinitionIndex(cls.cache_dir / 'definitions.sqlite')
+        cls.repository = Repository()
+        cls.image_store = ImageStore(cls.cache_dir / 'images')
+        cls.previews = PreviewCache(cls.cache_dir / 'previews.sqlite')
+        # the notebooks may be run from within other directories
+        outlines.root = cls.root_dir
+        cls.artifacts = (
+            ArtifactStore(
+                Path(artifacts_dir).absolute(),
+                hardlinks=hardlinks,
+                restored=RestoredFiles(cls.cache_dir / 'restored.sqlite')
+            )
+            if artifacts_dir is not None and str(artifacts_dir) != 'none' else
+            None
+        )
+        cls.kernel_pool = kernel_pool
+        cls.preload = preload
+        cls.defer_diffs = defer_diffs
+        cls.jobs = jobs
+        cls.diff_cache = DiffCache(cls.cache_dir / 'diffs', max_size=diff_cache_size) if diff_cache_size else None
+        cls.settings = {
+            'cache_dir': cls.cache_dir,
+            'tmp_dir': cls.tmp_dir,
+            'root_dir': cls.root_dir,
+            'environment': cls.environment,
+            'artifacts_dir': cls.artifacts.root if cls.artifacts else 'none',
+            'hardlinks': hardlinks,
+            'kernel_pool': kernel_pool,
+            'preload': preload,
+            'defer_diffs': defer_diffs,
+            'diff_cache_size': diff_cache_size,
+            'jobs': jobs
+        }
         cls.is_setup = True
 
+    def resolve(self, path) -> Path:
+        """Resolve path of an input or output (which can be used from within a different working directory)"""
+        return self.root_dir / path
+
     @abstractmethod
     def to_json(self):
         pass
@@ -147,7 +278,7 @@ class ShellRule(Rule):
     or a double dash for longer names.
      """
     def __init__(self, name, command, **kwargs):
-        super().__init__(self, name, **kwargs)
+        super().__init__(name, **kwargs)
         self.command = command
 
     def serialize(self, arguments_group):
@@ -186,70 +317,60 @@ class ShellRule(Rule):
 
     def to_json(self):
         return {
-            'name': self.command,
+            'name': self.name,
+            'command': self.command,
             'arguments': self.serialized_arguments,
             'execution_time': self.execution_time,
-            'type': 'shell'
+            'type': 'shell',
+            'status': self.status,
+            'skipped_because': self.skipped_because,
+            'group': self.group
         }
 
+    def to_graphiz(self):
+        return {
+            **self.to_json(),
+            'shape': 'box',
+            'label': self.name if self.status != SKIPPED else f'{self.name}\n(skipped: upstream failed)'
+        }
 
-def expand_run_magics(notebook):
-    out_notebook = copy(notebook)
-    new_cells = []
 
-    for cell in notebook['cells']:
-        if cell['cell_type'] != 'code':
-            new_cells.append(cell)
-            continue
+def expand_run_magics(notebook, load=read_notebook, resolver: IncludeResolver = None):
+    """Replace `%run` magics with the cells of the included notebooks (read with `load`, or by `resolver`)"""
+    return (resolver or IncludeResolver(load)).expand(notebook)
 
-        if any(line.startswith('%run') for line in cell['source']):
-            other_code = []
-            for line in cell['source']:
-                if line.startswith('%run'):
-                    if other_code:
-                        split_cell = copy(cell)
-                        split_cell['source'] = other_code
-                        new_cells.append(split_cell)
-                        other_code = []
-                    to_include = line[5:].strip()
-                    with open(to_include) as o:
-                        nb_run = json.load(o)
-                    new_cells.extend(nb_run['cells'])
-                else:
-                    other_code.append(line)
-            if other_code:
-                split_cell = copy(cell)
-                split_cell['source'] = other_code
-                new_cells.append(split_cell)
-        else:
-            new_cells.append(cell)
 
-    out_notebook['cells'] = new_cells
-    return out_notebook
+# shared by all the rules, so that the notebooks included by many others are read only once
+outlines = IncludeResolver(read_outline)
 
 
 class NotebookRule(Rule):
 
     options: None
 
+    # the attributes kept in the cached results of each run
+    cached_results = ['execution_time', 'fidelity', 'diff', 'text_diff', 'todos', 'headers', 'images']
+
     @property
     def output_nb_dir(self) -> Path:
         return self.tmp_dir / 'out'
 
-    @property
-    def reference_nb_dir(self) -> Path:
-        return self.tmp_dir / 'ref'
-
     @property
     def stripped_nb_dir(self) -> Path:
         return self.tmp_dir / 'stripped'
 
+    @property
+    def pending_nb_dir(self) -> Path:
+        """The executed notebooks waiting for their diffs to be computed, by the cache keys of their runs"""
+        return self.tmp_dir / 'pending'
+
     def __init__(
         self, *args, notebook,
         diff=True,
         deduce_io=True,
         deduce_io_from_data_vault=True,
         execute=True,
+        definition: dict = None,
         **kwargs
     ):
         """Rule for Jupyter Notebooks
@@ -264,6 +385,8 @@ class NotebookRule(Rule):
                 (`%vault store` and `%vault import`), see https://github.com/krassowski/data-vault
             execute: if False, the notebook will note be run; useful to include final "leaf" notebooks
                 which may take too long to run, but are not essential to the overall results
+            definition: the definition deduced from the notebook beforehand (e.g. in a worker process),
+                in the form kept in the definitions index (see `definition` attribute)
         """
         super().__init__(*args, **kwargs)
         self.todos = []
@@ -273,23 +396,94 @@ class NotebookRule(Rule):
         self.diff = None
         self.text_diff = None
         self.fidelity = None
+        # the diff to be computed later:
+        # {'output': path of a copy of the executed notebook, 'name': its original path, 'cache_key': key}
+        self.pending_diff = None
         self.images = []
         self.headers = []
-        self.status = None
+        # absolute paths of the notebooks included with `%run` (directly or not)
+        self.includes = []
         self.execute = execute
+        self._changes = None
+
+        definition_key = self.definition_key(
+            self.absolute_notebook_path, self.inputs, self.outputs, deduce_io, deduce_io_from_data_vault
+        )
+        if definition is None and self.definitions:
+            definition = self.definitions.get(definition_key)
 
-        from datetime import datetime, timedelta
-        month_ago = (datetime.today() - timedelta(days=30)).timestamp()
-        self.changes = run_command(f'git rev-list --max-age {month_ago} HEAD --count {self.notebook}')
+        # the definitions stored by the previous versions did not keep the warnings nor the includes
+        if definition is None or not {'warnings', 'includes'} <= definition.keys():
+            files = stat_files([self.absolute_notebook_path])
 
-        if deduce_io:
-            self.deduce_io_from_tags()
+            with catch_warnings(record=True) as caught:
+                simplefilter('always')
 
-        if deduce_io_from_data_vault:
-            self.deduce_io_from_data_vault()
+                if deduce_io:
+                    self.deduce_io_from_tags()
+
+                if deduce_io_from_data_vault:
+                    self.deduce_io_from_data_vault()
+
+                self.deduce_headers_and_todos()
+
+            dependencies = outlines.dependencies(self.unexpanded_outline)
+            self.includes = [path for path, _, _ in dependencies]
+
+            definition = {
+                'inputs': self.inputs,
+                'outputs': self.outputs,
+                'headers': self.headers,
+                'todos': self.todos,
+                'includes': self.includes,
+                # to be shown again each time the rule is defined, even if the notebook is not read
+                'warnings': [(str(warning.message), warning.category) for warning in caught]
+            }
+            if self.definitions and files is not None:
+                self.definitions.put(definition_key, files + dependencies, definition)
+        else:
+            self.inputs = definition['inputs']
+            self.outputs = definition['outputs']
+            self.headers = definition['headers']
+            self.todos = definition['todos']
+            self.includes = definition['includes']
+
+        for message, category in definition.get('warnings', []):
+            warn(message, category)
+        # what was deduced from the notebook (and the warnings shown meanwhile)
+        self.definition = definition
+
+    @staticmethod
+    def definition_key(notebook: Path, inputs: dict, outputs: dict, deduce_io: bool, deduce_io_from_data_vault: bool):
+        """Key of the definition deduced from the notebook in the definitions index"""
+        return cache_key(
+            str(Path(notebook).absolute()),
+            repr(canonical(inputs)),
+            repr(canonical(outputs)),
+            repr((deduce_io, deduce_io_from_data_vault))
+        )
+
+    @property
+    def changes(self) -> Optional[int]:
+        """The number of commits changing the notebook in the last 30 days"""
+        if self._changes is None and self.repository:
+            # the commits of all the notebooks are counted at once, the first time it is needed
+            self._changes = self.repository.recent_changes(self.absolute_notebook_path)
+        return self._changes
+
+    def deduce_headers_and_todos(self):
+        self.headers = []
+        self.todos = []
+
+        for cell in self.notebook_outline['cells']:
+            for line in cell.get('source', ''):
+                if cell['cell_type'] == 'markdown' and line.startswith('#'):
+                    self.headers.append(line)
+                if 'TODO' in line:
+                    self.todos.append(line)
 
     def deduce_io_from_data_vault(self):
-        notebook_json = self.notebook_json
+        notebook_json = self.notebook_outline
         stored = set()
         for index, cell in enumerate(notebook_json['cells']):
             if 'source' not in cell:
@@ -328,7 +522,7 @@ class NotebookRule(Rule):
                             stored.add(store_path)
 
     def deduce_io_from_tags(self, io_tags={'inputs', 'outputs'}):
-        notebook_json = self.notebook_json
+        notebook_json = self.notebook_outline
         io_cells = {}
 
         for index, cell in enumerate(notebook_json['cells']):
@@ -377,14 +571,136 @@ class NotebookRule(Rule):
             if arguments_group
         })
 
+    @property
+    def papermill_parameters(self) -> dict:
+        return {
+            key: value
+            for arguments_group in self.arguments.values()
+            if arguments_group
+            for key, value in arguments_group.items()
+        }
+
+    @property
+    def kernel_name(self) -> str:
+        return self.notebook_outline.get('metadata', {}).get('kernelspec', {}).get('name', 'python3')
+
     def outline(self, max_depth=3):
         return self.headers
 
+    @property
+    def sources(self) -> Dict[str, Path]:
+        return {
+            'notebook': self.absolute_notebook_path,
+            **{
+                f'included notebook {relpath(path, self.root_dir)}': Path(path)
+                for path in self.includes
+            }
+        }
+
     @property
     @lru_cache()
+    def unexpanded_outline(self):
+        """The notebook without outputs (other than the metadata of the cells defining inputs/outputs)"""
+        return read_outline(self.absolute_notebook_path)
+
+    @property
+    @lru_cache()
+    def notebook_outline(self):
+        """The outline with `%run` magics replaced by the cells of the included notebooks"""
+        return expand_run_magics(self.unexpanded_outline, resolver=outlines)
+
+    @property
     def notebook_json(self):
-        with open(self.absolute_notebook_path) as f:
-            return expand_run_magics(json.load(f))
+        """The whole notebook, including the outputs; read anew each time, as it can be large"""
+        return expand_run_magics(
+            read_notebook(self.absolute_notebook_path),
+            resolver=IncludeResolver(read_notebook, root=self.root_dir)
+        )
+
+    def cache_key(self) -> str:
+        """Hash of everything what the results of the notebook execution depend on"""
+        inputs_hashes = {
+            name: hash_path(self.resolve(path))
+            for name, path in self.inputs.items()
+        }
+        arguments = {
+            'input': self.inputs,
+            'output': self.outputs,
+            'parameters': self.parameters,
+            'execute': self.execute,
+            'diff': self.generate_diff
+        }
+        return cache_key(
+            notebook_source(self.notebook_outline),
+            repr(canonical(inputs_hashes)),
+            repr(canonical(arguments)),
+            self.environment or ''
+        )
+
+    def load_cached(self, cache_file: Path, key: str):
+        if cache_file.exists():
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+        if self.artifacts:
+            return self.artifacts.load_record(key)
+
+    def save_cached(self, cache_file: Path, key: str, pickled: dict):
+        if self.artifacts:
+            # the images are kept in the local image store, but the records may be used by other machines
+            pickled = {
+                **pickled,
+                'image_objects': {
+                    digest: self.artifacts.store_file(self.image_store.image_path(digest))
+                    for digest in pickled.get('images', [])
+                    if self.image_store.is_digest(digest) and self.image_store.has(digest)
+                }
+            }
+            self.artifacts.save_record(key, pickled)
+        with open(cache_file, 'wb') as f:
+            pickle.dump(pickled, f)
+
+    def cache_file(self, key: str) -> Path:
+        cache_dir = self.cache_dir / Path(self.notebook).parent
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        return cache_dir / f'{key}.json'
+
+    def restore_outputs(self, manifests) -> bool:
+        """Restore outputs from the artifact store, returns False if any of them could not be restored"""
+        for output, manifest in manifests.items():
+            if manifest is None:
+                # was not a file nor a directory (e.g. a data-vault path)
+                continue
+            if not self.artifacts or not self.artifacts.restore(self.resolve(output), manifest):
+                return False
+        return True
+
+    def set_results(self, pickled: dict) -> bool:
+        """Use the cached results, unless any of their images is missing and cannot be restored
+
+        (e.g. if these were cached on another machine, and the artifacts store is not shared).
+        """
+        # the results cached by the previous versions had the images inlined
+        images = [
+            image if self.image_store.is_digest(image) else self.image_store.store(image)
+            for image in pickled['images']
+        ]
+        image_objects = pickled.get('image_objects', {})
+        for image in images:
+            if self.image_store.has(image):
+                continue
+            digest = image_objects.get(image)
+            if digest is None or not self.artifacts or not self.artifacts.is_intact(digest):
+                return False
+            self.image_store.store_data(self.artifacts.object_path(digest).read_bytes())
+        for key in self.cached_results:
+            setattr(self, key, pickled[key])
+        self.images = images
+        self.pending_diff = pickled.get('pending_diff')
+        return True
+
+    def load_results(self, key: str) -> bool:
+        pickled = self.load_cached(self.cache_file(key), key)
+        return pickled is not None and self.set_results(pickled)
 
     def maybe_create_output_dirs(self):
         if self.has_outputs:
@@ -409,116 +725,137 @@ class NotebookRule(Rule):
         output_nb_dir = self.output_nb_dir / path.parent
         output_nb_dir.mkdir(parents=True, exist_ok=True)
 
-        reference_nb_dir = self.reference_nb_dir / path.parent
-        reference_nb_dir.mkdir(parents=True, exist_ok=True)
-
         stripped_nb_dir = self.stripped_nb_dir / path.parent
         stripped_nb_dir.mkdir(parents=True, exist_ok=True)
 
         output_nb = output_nb_dir / path.name
-        reference_nb = reference_nb_dir / path.name
         stripped_nb = stripped_nb_dir / path.name
 
-        md5 = run_command(f'md5sum {str(self.absolute_notebook_path)}').split()[0]
-
-        cache_dir = self.cache_dir / path.parent
-        cache_dir.mkdir(parents=True, exist_ok=True)
-
-        cache_nb_file = cache_dir / f'{md5}.json'
+        cache_id = self.cache_key()
+        cache_nb_file = self.cache_file(cache_id)
 
-        to_cache = ['execution_time', 'fidelity', 'diff', 'text_diff', 'todos', 'headers', 'images']
-
-        if use_cache and cache_nb_file.exists():
-            with open(cache_nb_file, 'rb') as f:
-                pickled = pickle.load(f)
+        if use_cache:
+            pickled = self.load_cached(cache_nb_file, cache_id)
+            if (
+                pickled is not None
+                and self.restore_outputs(pickled.get('outputs', {}))
+                and self.set_results(pickled)
+            ):
                 print(f'Reusing cached results for {self}')
-                for key in to_cache:
-                    setattr(self, key, pickled[key])
                 return 0
 
-        notebook_json = self.notebook_json
+        if self.artifacts:
+            for output in self.outputs.values():
+                self.artifacts.detach(self.resolve(output))
 
+        # stored once (by content), only their hashes are kept
         self.images = [
-            output['data']['image/png']
-            for cell in notebook_json['cells']
-            for output in cell.get('outputs', [])
-            if 'data' in output and 'image/png' in output['data']
+            self.image_store.store(image)
+            for image in read_images(self.absolute_notebook_path)
         ]
 
-        self.headers = []
-
-        for cell in notebook_json['cells']:
-            if cell['cell_type'] == 'markdown':
-                for line in cell['source']:
-                    if line.startswith('#'):
-                        self.headers.append(line)
-
-        for cell in notebook_json['cells']:
-            for line in cell.get('source', ''):
-                if 'TODO' in line:
-                    self.todos.append(line)
-
-        # strip outputs (otherwise if it stops, the diff will be too optimistic)
-        notebook_stripped = deepcopy(notebook_json)
-        for cell in notebook_json['cells']:
-            cell['outputs'] = []
-
+        # strip outputs (otherwise if it stops, the diff will be too optimistic);
+        # the outline has everything but the outputs, so the full notebook is not needed
         with open(stripped_nb, 'w') as f:
-            json.dump(notebook_stripped, f)
+            json.dump(strip_outputs(self.notebook_outline), f)
 
         if self.execute:
             # execute
             start_time = time.time()
-            status = system(f'papermill {stripped_nb} {output_nb} {self.serialized_arguments}') or 0
+            if self.kernel_pool:
+                status = execute_notebook(
+                    stripped_nb, output_nb, self.papermill_parameters, cwd=Path.cwd(),
+                    kernel_name=self.kernel_name, pool_size=self.kernel_pool, preload=self.preload
+                )
+            else:
+                status = system(f'papermill {stripped_nb} {output_nb} {self.serialized_arguments}') or 0
             self.execution_time = time.time() - start_time
         else:
             status = 0
             warn(f'Skipping {self} (execute != True)')
 
+        self.pending_diff = None
         if self.execute and self.generate_diff:
-
-            # inject parameters to a "reference" copy (so that we do not have spurious noise in the diff)
-            system(
-                f'papermill {self.absolute_notebook_path} {reference_nb} {self.serialized_arguments} --prepare-only'
-                # do not print "Input Notebook:" and "Output Notebook:" for the second time
-                ' --log-level WARNING'
-            )
-
-            with NamedTemporaryFile(delete=False) as tf:
-                command = f'nbdiff {reference_nb} {output_nb} --ignore-metadata --ignore-details --out {tf.name}'
-                result = run_command(command)
-                with open(tf.name) as f:
-                    try:
-                        self.diff = json.load(f)
-                    except JSONDecodeError as e:
-                        warn(f'Could not load the diff file: {result}, {f.readlines()}')
-
-            command = f'nbdiff {reference_nb} {output_nb} --ignore-metadata --ignore-details --no-use-diff --no-git'
-            self.text_diff = run_command(command)
-
-            from ansi2html import Ansi2HTMLConverter
-            conv = Ansi2HTMLConverter()
-            self.text_diff = conv.convert(self.text_diff)
-
-            changes = len(self.diff[0]['diff']) if self.diff else 0
-
-            # TODO: count only the code cells, not markdown cells?
-            total_cells = len(notebook_json['cells'])
-            self.fidelity = (total_cells - changes) / total_cells * 100
+            if self.defer_diffs:
+                # the output will be overwritten by the next run of the notebook, possibly before the diff is computed
+                pending_nb = self.pending_nb_dir / f'{cache_id}.ipynb'
+                if output_nb.exists():
+                    pending_nb.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copyfile(output_nb, pending_nb)
+                self.pending_diff = {'output': str(pending_nb), 'name': str(output_nb), 'cache_key': cache_id}
+            else:
+                self.compute_diff(output_nb)
 
         if status == 0:
-            with open(cache_nb_file, 'wb') as f:
-                pickle.dump({
-                    key: getattr(self, key)
-                    for key in to_cache
-                }, f)
+            pickled = {
+                key: getattr(self, key)
+                for key in self.cached_results
+            }
+            pickled['pending_diff'] = self.pending_diff
+            if self.artifacts:
+                pickled['outputs'] = {
+                    output: self.artifacts.store(self.resolve(output))
+                    for output in self.outputs.values()
+                }
+            self.save_cached(cache_nb_file, cache_id, pickled)
 
         self.status = status
 
         return status
 
-    def to_json(self):
+    def compute_diff(self, output_nb: Path, name: str = None):
+        """Compare the executed notebook with the current version of the notebook
 
+        Args:
+            name: of the executed notebook, as shown in the diff (by default its path)
+        """
+        name = name or str(output_nb)
+        if not output_nb.exists():
+            warn(f'Could not compute the diff for {self}: {output_nb} does not exist')
+            return
+
+        import nbformat
+        # inject parameters to a "reference" copy (so that we do not have spurious noise in the diff)
+        reference = reference_notebook(self.absolute_notebook_path, self.papermill_parameters)
+        executed = nbformat.read(str(output_nb), as_version=4)
+
+        key = diff_key(reference, executed, self.notebook, name)
+        cached = self.diff_cache.get(key) if self.diff_cache else None
+        if cached is not None:
+            self.diff, self.text_diff = cached['diff'], cached['text_diff']
+        else:
+            self.diff = diff_notebooks(reference, executed)
+            self.text_diff = diff_to_html(reference, self.diff, self.notebook, name)
+            if self.diff_cache:
+                self.diff_cache.put(key, {'diff': self.diff, 'text_diff': self.text_diff})
+
+        changes = len(self.diff[0]['diff']) if self.diff else 0
+
+        # TODO: count only the code cells, not markdown cells?
+        total_cells = len(self.notebook_outline['cells'])
+        self.fidelity = (total_cells - changes) / total_cells * 100
+
+    def compute_pending_diff(self):
+        """Compute the diff deferred by `run()` and store it in the cached results of that run"""
+        pending, self.pending_diff = self.pending_diff, None
+        if not pending:
+            return
+        output_nb = Path(pending['output'])
+        self.compute_diff(output_nb, name=pending.get('name'))
+        if output_nb.exists():
+            output_nb.unlink()
+        cache_file = self.cache_file(pending['cache_key'])
+        pickled = self.load_cached(cache_file, pending['cache_key'])
+        if pickled is not None:
+            pickled.update(
+                pending_diff=None,
+                fidelity=self.fidelity,
+                diff=self.diff,
+                text_diff=self.text_diff
+            )
+            self.save_cached(cache_file, pending['cache_key'], pickled)
+
+    def to_json(self):
         notebook_name = Path(self.notebook).name
         
         return {
@@ -537,6 +874,7 @@ class NotebookRule(Rule):
             'label': self.notebook,
             'headers': self.headers,
             'status': self.status,
+            'skipped_because': self.skipped_because,
             'todos': self.todos,
             'group': self.group
             # TODO: requires testing
@@ -552,6 +890,9 @@ class NotebookRule(Rule):
         if changes:   # TODO allow to activate
             buttons += [f'<td href="{self.repository_url}/commits/master/{self.notebook}">{self.changes} changes this month</td>']
 
+        if self.status == SKIPPED:
+            buttons += ['<td bgcolor="#fff3cd">Skipped (upstream failed)</td>']
+
         if self.fidelity is not None:
             buttons += [f'<td href="">Reproducibility: {self.fidelity:.2f}%</td>']
 
@@ -572,12 +913,46 @@ class NotebookRule(Rule):
         }
 
 
-def is_tracked_in_version_control(file: str):
-    return check_output(f'git ls-files {file}', shell=True)
+def is_tracked_in_version_control(file: str, repository: Repository = None) -> bool:
+    repository = repository or Rule.repository or Repository()
+    return repository.is_tracked(file)
+
+
+def setup_discovery_worker(settings: dict, index_definitions: bool):
+    if settings:
+        Rule.setup(**settings)
+    if not index_definitions:
+        Rule.definitions = None
+    # the rules defined in the main process before the workers were started are not needed
+    Rule.rules = {}
 
 
-def discover_notebooks(root_path='.', ignore=None, ignored_dirs=None, only_tracked_in_git=False, ignore_prefixes=('__', '.')):
-    """Useful when working with input/output auto-detection"""
+def deduce_in_worker(path: str) -> Optional[dict]:
+    """Deduce the definition of the notebook rule (storing it in the definitions index, if enabled)
+
+    Returns: the definition, including the warnings (to be shown by the main process)
+    """
+    try:
+        with catch_warnings(record=True):
+            simplefilter('always')
+            return NotebookRule(path, notebook=path).definition
+    except Exception:
+        # will be raised again (with a proper traceback) once the rule gets defined in the main process
+        return None
+
+
+def discover_notebooks(
+    root_path='.', ignore=None, ignored_dirs=None, only_tracked_in_git=False, ignore_prefixes=('__', '.'),
+    jobs: int = None, mp_context=None
+):
+    """Useful when working with input/output auto-detection
+
+    Args:
+        jobs: the number of processes reading the notebooks (which changed since the last time, or were not
+            seen before); by default as many as given to `Rule.setup()` (`--jobs`), i.e. only the current one.
+            The rules are always defined in the same (alphabetical) order.
+        mp_context: the multiprocessing context of the processes (by default that of the platform)
+    """
     ignored_dirs = ignored_dirs or set()
     ignore = ignore or set()
     names = {}
@@ -585,19 +960,25 @@ def discover_notebooks(root_path='.', ignore=None, ignored_dirs=None, only_track
 
     from typing import Dict
     groups: Dict[str, Group] = {}
+    repository = Rule.repository or Repository()
+
+    found = []
 
-    for dirpath, _, files in walk(root_path):
+    for dirpath, dirnames, files in walk(root_path):
+        # prune the ignored directories, so that these are never visited
+        dirnames[:] = sorted(
+            dir for dir in dirnames
+            if not dir.startswith('.') and dir not in ignored_dirs
+        )
         dirs = dirpath.split(sep)[1:]
-        if any(dir.startswith('.') or dir in ignored_dirs for dir in dirs):
-            continue
-        for file in files:
+        for file in sorted(files):
             if any(file.startswith(prefix) for prefix in ignore_prefixes):
                 continue
             if not file.endswith('.ipynb'):
                 continue
-            if only_tracked_in_git and not is_tracked_in_version_control(file):
-                continue
             path = sep.join(dirs + [file])
+            if only_tracked_in_git and not repository.is_tracked(Path(dirpath) / file):
+                continue
             if path in ignore:
                 continue
             name = file[:-6]
@@ -606,11 +987,35 @@ def discover_notebooks(root_path='.', ignore=None, ignored_dirs=None, only_track
                 print(name, 'already registered', path, names[name])
             else:
                 names[name] = path
-                group_id = sep.join(dirs) if dirs else None
-                rule = NotebookRule(name, notebook=path, group=group_id)
-                rules.append(rule)
-                if group_id and group_id not in groups:
-                    groups[group_id] = Group(id=group_id, name=dirs[-1], parent=sep.join(dirs[:-1]))
+                found.append((name, path, dirs))
+
+    jobs = jobs or Rule.jobs
+    # path: the definition from the index, or deduced by a worker process
+    definitions = {}
+    if jobs > 1:
+        if Rule.definitions:
+            for name, path, dirs in found:
+                definition = Rule.definitions.get(NotebookRule.definition_key(path, {}, {}, True, True))
+                if definition is not None:
+                    definitions[path] = definition
+        to_deduce = [path for name, path, dirs in found if path not in definitions]
+        if len(to_deduce) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(jobs, len(to_deduce)),
+                mp_context=mp_context,
+                initializer=partial(setup_discovery_worker, Rule.settings, bool(Rule.definitions))
+            ) as pool:
+                chunksize = max(1, len(to_deduce) // (jobs * 4))
+                definitions.update(zip(to_deduce, pool.map(deduce_in_worker, to_deduce, chunksize=chunksize)))
+
+    for name, path, dirs in found:
+        group_id = sep.join(dirs) if dirs else None
+        # the notebooks deduced by the workers are not read again (and their warnings are shown now),
+        # nor are the definitions looked up in the index again
+        rule = NotebookRule(name, notebook=path, group=group_id, definition=definitions.get(path))
+        rules.append(rule)
+        if group_id and group_id not in groups:
+            groups[group_id] = Group(id=group_id, name=dirs[-1], parent=sep.join(dirs[:-1]))
     return {
         'rules': rules,
         'groups': groups
@@ -0,0 +1,268 @@
+import os
+import sys
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from heapq import heapify, heappop, heappush
+from pathlib import Path
+from tempfile import TemporaryFile
+from typing import Collection, Dict, Optional
+
+from tqdm import tqdm
+
+from .journal import Journal
+from .rules import Rule, SKIPPED
+from .utils import cd
+
+
+def execute_rule(rule: Rule, use_cache=True, run_from_root=False, make_output_dirs=False) -> int:
+    """Run a single rule from within the directory of its notebook (if any)."""
+    if make_output_dirs and hasattr(rule, 'maybe_create_output_dirs'):
+        rule.maybe_create_output_dirs()
+    with ExitStack() as stack:
+        if not run_from_root and hasattr(rule, 'notebook'):
+            stack.enter_context(cd(Path(rule.notebook).parent))
+        return rule.run(use_cache=use_cache)
+
+
+@contextmanager
+def captured_output():
+    """Redirect stdout and stderr on the file descriptor level,
+
+    so that the output of subprocesses (e.g. papermill) is captured too.
+    """
+    with TemporaryFile(mode='w+') as log:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved = [os.dup(1), os.dup(2)]
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        captured = []
+        try:
+            yield captured
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, saved_fd in zip([1, 2], saved):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+            log.seek(0)
+            captured.append(log.read())
+
+
+def run_in_worker(rule: Rule, options: dict):
+    with captured_output() as output:
+        status = execute_rule(rule, **options)
+    # the rule was modified in the worker process only, send its state back
+    return status, rule.__dict__, output[0]
+
+
+def compute_diff_in_worker(rule: Rule):
+    with captured_output() as output:
+        rule.compute_pending_diff()
+    state = {
+        key: getattr(rule, key)
+        for key in ['diff', 'text_diff', 'fidelity', 'pending_diff']
+    }
+    return state, output[0]
+
+
+class Scheduler:
+    """Run rules as soon as all the rules producing their inputs have finished,
+
+    using up to `jobs` worker processes. The output of each rule is captured
+    and printed in a stable (topological) order, regardless of the order
+    in which the rules actually finished.
+
+    When a rule fails, the rules downstream of it are skipped (rather than run
+    on stale or missing inputs), while the independent branches keep running.
+
+    If the diffs are deferred (see `Rule.setup()`), these are computed by a separate
+    pool of background workers, so that the downstream rules do not wait for them.
+    """
+
+    def __init__(
+        self, graph, jobs=1, rules: Collection[Rule] = None, forced: Collection[Rule] = (),
+        fail_fast=False, journal: Journal = None, **options
+    ):
+        """
+        Args:
+            graph: RulesGraph
+            jobs: the maximal number of rules to run at once
+            rules: the rules to run (by default all); the other rules are assumed to be up to date
+            forced: the rules to be re-run even if cached results are available
+            fail_fast: do not start any new rules once any rule failed
+            journal: where to record the progress (so that the run can be resumed if interrupted)
+            **options: passed to `execute_rule()`
+        """
+        self.graph = graph
+        self.jobs = jobs
+        self.options = options
+        self.forced = set(forced)
+        self.fail_fast = fail_fast
+        self.journal = journal
+        self.order = [
+            rule
+            for rule in graph.iterate_rules()
+            if rules is None or rule in rules
+        ]
+        selected = set(self.order)
+        self.dependencies = {
+            rule: dependencies & selected
+            for rule, dependencies in graph.rule_dependencies().items()
+            if rule in selected
+        }
+        self.dependants = defaultdict(list)
+        for rule, dependencies in self.dependencies.items():
+            for dependency in dependencies:
+                self.dependants[dependency].append(rule)
+        self.diff_pool = None
+        self.diffs = {}
+
+    def options_for(self, rule: Rule) -> dict:
+        if rule in self.forced:
+            return {**self.options, 'use_cache': False}
+        return self.options
+
+    def skip_downstream(self, failed: Rule, statuses: Dict[Rule, Optional[int]]):
+        """Mark all the rules downstream of the failed rule as skipped"""
+        queue = deque(self.dependants[failed])
+        while queue:
+            rule = queue.popleft()
+            if rule in statuses:
+                continue
+            statuses[rule] = None
+            rule.status = SKIPPED
+            rule.skipped_because = failed.name
+            self.graph.update(rule)
+            queue.extend(self.dependants[rule])
+
+    def report(self, rule: Rule, status: Optional[int], output: str = ''):
+        if output:
+            tqdm.write(output, end='' if output.endswith('\n') else '\n')
+        if rule.status == SKIPPED:
+            tqdm.write(f'Skipped {rule}: upstream rule {rule.skipped_because!r} failed')
+        elif status is None:
+            tqdm.write(f'Did not run {rule}: stopped after the first failure')
+        elif status != 0:
+            tqdm.write(f'{rule} failed with status {status}')
+
+    def start(self, rule: Rule):
+        if self.journal:
+            self.journal.started(rule)
+
+    def finish(self, rule: Rule, status: int, statuses: Dict[Rule, Optional[int]]):
+        rule.status = status
+        self.graph.update(rule)
+        if self.journal:
+            self.journal.finished(rule, status)
+        statuses[rule] = status
+        if status != 0:
+            self.skip_downstream(rule, statuses)
+        elif self.diff_pool and getattr(rule, 'pending_diff', None):
+            self.diffs[rule] = self.diff_pool.submit(compute_diff_in_worker, rule)
+
+    def collect_diffs(self):
+        """Wait for the deferred diffs, in the topological order"""
+        if not self.diffs:
+            return
+        for rule in tqdm(self.order, desc='Computing diffs'):
+            if rule not in self.diffs:
+                continue
+            try:
+                state, output = self.diffs.pop(rule).result()
+            except Exception as e:
+                # the diff remains pending, it will be retried once needed
+                tqdm.write(f'Could not compute the diff for {rule}: {e!r}')
+                continue
+            rule.__dict__.update(state)
+            self.graph.update(rule)
+            if output:
+                tqdm.write(output, end='' if output.endswith('\n') else '\n')
+
+    def run_serially(self) -> Dict[Rule, Optional[int]]:
+        statuses = {}
+        stopped = False
+        for rule in self.order:
+            if rule not in statuses and not stopped:
+                self.start(rule)
+                self.finish(rule, execute_rule(rule, **self.options_for(rule)), statuses)
+                stopped = self.fail_fast and statuses[rule] != 0
+            self.report(rule, statuses.get(rule))
+        return {rule: statuses.get(rule) for rule in self.order}
+
+    def run(self) -> Dict[Rule, Optional[int]]:
+        """Returns: status codes of the rules, in the topological order (None for the rules which did not run)"""
+        for rule in self.order:
+            rule.status = None
+            rule.skipped_because = None
+            self.graph.update(rule)
+
+        with ExitStack() as stack:
+            if Rule.defer_diffs:
+                self.diff_pool = stack.enter_context(ProcessPoolExecutor(
+                    max_workers=self.jobs,
+                    initializer=partial(Rule.setup, **Rule.settings)
+                ))
+            statuses = self.run_serially() if self.jobs <= 1 else self.run_in_parallel()
+            self.collect_diffs()
+        self.diff_pool = None
+        return statuses
+
+    def run_in_parallel(self) -> Dict[Rule, Optional[int]]:
+        position = {rule: i for i, rule in enumerate(self.order)}
+        waiting_for = {rule: len(self.dependencies[rule]) for rule in self.order}
+
+        ready = [position[rule] for rule in self.order if not waiting_for[rule]]
+        heapify(ready)
+
+        statuses = {}
+        outputs = {}
+        reported = 0
+        running = {}
+        stopped = False
+
+        with ExitStack() as stack:
+            pool = stack.enter_context(ProcessPoolExecutor(
+                max_workers=self.jobs,
+                initializer=partial(Rule.setup, **Rule.settings)
+            ))
+            progress = stack.enter_context(tqdm(total=len(self.order), desc='Running rules'))
+
+            while running or (ready and not stopped):
+                while ready and not stopped and len(running) < self.jobs:
+                    rule = self.order[heappop(ready)]
+                    self.start(rule)
+                    running[pool.submit(run_in_worker, rule, self.options_for(rule))] = rule
+                progress.set_postfix(running=len(running))
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    rule = running.pop(future)
+                    status, state, output = future.result()
+                    rule.__dict__.update(state)
+                    outputs[rule] = output
+                    skipped_before = len(statuses)
+                    self.finish(rule, status, statuses)
+                    progress.update(len(statuses) - skipped_before)
+
+                    if status != 0:
+                        stopped = stopped or self.fail_fast
+                        continue
+
+                    for dependant in self.dependants[rule]:
+                        waiting_for[dependant] -= 1
+                        if not waiting_for[dependant] and dependant not in statuses:
+                            heappush(ready, position[dependant])
+
+                while reported < len(self.order) and self.order[reported] in statuses:
+                    rule = self.order[reported]
+                    self.report(rule, statuses[rule], outputs.pop(rule, ''))
+                    reported += 1
+
+        for rule in self.order[reported:]:
+            self.report(rule, statuses.get(rule), outputs.pop(rule, ''))
+
+        return {rule: statuses.get(rule) for rule in self.order}
@@ -1,5 +1,7 @@
 from contextlib import contextmanager
 import os
+import shutil
+import sqlite3
 from pathlib import Path
 
 
@@ -25,6 +27,21 @@ def nice_time(seconds):
         return f'{seconds/60:.2f} min'
 
 
+def modification_time(path: Path, newest=True, file_time=None) -> int:
+    """Modification time of a file, or of the newest (or oldest) file in a directory
+
+    Args:
+        file_time: function returning the modification time of a file, by default from its stat
+    """
+    path = Path(path)
+    file_time = file_time or (lambda file: file.stat().st_mtime_ns)
+    if path.is_dir():
+        times = [file_time(file) for file in path.rglob('*') if file.is_file()]
+        if times:
+            return max(times) if newest else min(times)
+    return file_time(path)
+
+
 @contextmanager
 def cd(path: Path):
     last_path = Path.cwd()
@@ -33,3 +50,49 @@ def cd(path: Path):
         yield
     finally:
         os.chdir(last_path)
+
+
+def temporary_path(path: Path) -> Path:
+    """A path next to the given one, to be moved over it once written (see `atomic_write()`)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+
+
+def atomic_write(path: Path, data: bytes):
+    """Write so that the other processes (or machines) never see a partially written file"""
+    temporary = temporary_path(path)
+    temporary.write_bytes(data)
+    os.replace(temporary, path)
+
+
+def atomic_copy(source: Path, target: Path):
+    """Copy, replacing the target at once (like `atomic_write()`)"""
+    temporary = temporary_path(target)
+    shutil.copyfile(source, temporary)
+    os.replace(temporary, target)
+
+
+class SQLiteStore:
+    """Persistent key-value data in an SQLite database, which can be used by multiple processes at once"""
+
+    # statement creating the table, if it does not exist yet
+    schema: str = None
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # connections cannot be shared with the forked processes
+        if self._connection is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # these are caches: losing the last entries on power failure is fine, waiting for the disk is not
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(self.schema)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
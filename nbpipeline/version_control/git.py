@@ -1,3 +1,11 @@
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from subprocess import run, PIPE, DEVNULL
+from typing import Set
+
 from ..utils import run_command
 
 
@@ -23,3 +31,43 @@ def infer_repository_url():
     except Exception:
         return
 
+
+class Repository:
+    """Metadata of the files in a git repository, collected for all the files at once
+
+    (with a single git command for each kind of metadata, run only once it is needed).
+    Paths are relative to `path` (the directory the repository is queried from).
+    """
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path or Path.cwd()).absolute()
+
+    def git(self, *arguments) -> str:
+        # not a repository (or git not installed) is equivalent to no files being tracked
+        try:
+            result = run(['git', *arguments], cwd=self.path, stdout=PIPE, stderr=DEVNULL)
+        except OSError:
+            return ''
+        return result.stdout.decode('utf-8') if result.returncode == 0 else ''
+
+    def relative(self, path) -> str:
+        return Path(os.path.relpath(Path(path).absolute(), self.path)).as_posix()
+
+    @property
+    @lru_cache()
+    def tracked_files(self) -> Set[str]:
+        return set(self.git('ls-files', '-z').split('\0')) - {''}
+
+    @lru_cache()
+    def changes_since(self, days: int) -> Counter:
+        """Count the commits in the last `days` days, for each file"""
+        since = (datetime.today() - timedelta(days=days)).timestamp()
+        files = self.git('log', f'--max-age={int(since)}', '--format=', '--name-only', '-z', '--relative')
+        # each commit lists the files it changed (once)
+        return Counter(file for file in files.split('\0') if file)
+
+    def is_tracked(self, path) -> bool:
+        return self.relative(path) in self.tracked_files
+
+    def recent_changes(self, path, days=30) -> int:
+        return self.changes_since(days)[self.relative(path)]
@@ -1,9 +1,15 @@
 import json
+from hashlib import sha256
+from os.path import relpath
 from pathlib import Path
+from typing import List
+from urllib.parse import quote
 
 from jinja2 import Environment, select_autoescape, FileSystemLoader
 
-from ..rules import Group
+from ..rules import Group, Rule
+from ..utils import atomic_write
+from .layout import LayoutCache
 
 
 def render_template(path, **kwargs):
@@ -16,17 +22,90 @@ def render_template(path, **kwargs):
     return template.render(**kwargs)
 
 
-def generate_graph(rules_dag, **kwargs):
+# what is needed to draw the nodes; everything else (diffs, images, previews...) is in the details
+SUMMARY_FIELDS = {
+    'name', 'id', 'type', 'group', 'label', 'shape', 'status', 'skipped_because', 'execution_time', 'nice_time',
+    'notebook', 'notebook_name', 'fidelity', 'changes_this_month', 'command', 'exists'
+}
+
+
+def write_details(nodes: List[dict], directory: Path) -> List[dict]:
+    """Move the details of the nodes to separate files (shards), loaded by the report once needed.
+
+    The shards are named by the hashes of their contents, so that only the details
+    which changed are written again; the shards no longer used are removed.
+    The shards are scripts (rather than JSON files) as the report is opened from
+    the file system, where the browsers do not allow to fetch the files.
+
+    Returns: the summaries of the nodes, each referring to its shard by the "details" key
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    summaries = []
+    shards = set()
+
+    for node in nodes:
+        summary = {key: value for key, value in node.items() if key in SUMMARY_FIELDS}
+        details = {key: value for key, value in node.items() if key not in SUMMARY_FIELDS}
+        # for the label of the node
+        summary['images_count'] = len(node.get('images') or [])
+        summary['todos_count'] = len(node.get('todos') or [])
+
+        content = json.dumps(details, sort_keys=True)
+        shard = sha256(content.encode()).hexdigest()
+        summary['details'] = shard
+        summaries.append(summary)
+
+        if shard not in shards:
+            shards.add(shard)
+            path = directory / f'{shard}.js'
+            if not path.exists():
+                atomic_write(path, f'report_details({json.dumps(shard)}, {content});'.encode())
+
+    for path in directory.glob('*.js'):
+        if path.stem not in shards:
+            path.unlink()
+
+    return summaries
+
+
+def images_url(report_path: Path = None) -> str:
+    """The URL of the images store, relative to the report (if its path is given)"""
+    if not Rule.image_store:
+        return ''
+    root = Rule.image_store.root.absolute()
+    if report_path is not None:
+        try:
+            return quote(Path(relpath(root, Path(report_path).absolute().parent)).as_posix())
+        except ValueError:
+            # on a different drive than the report
+            pass
+    return root.as_uri()
+
+
+def generate_graph(
+    rules_graph, details_dir: Path = None, layouts: LayoutCache = None, report_path: Path = None, **kwargs
+):
+    """Args:
+        rules_graph: RulesGraph; only the nodes which changed since the last report are re-computed
+        details_dir: if given, the details of the nodes are written to separate files in this directory
+            (which has to be next to the report), and are only loaded by the report once needed;
+            otherwise everything is embedded in the report
+        layouts: if given, the graph is laid out in advance (with graphviz; the layouts are cached
+            until the structure of the graph changes), rather than in the browser
+        report_path: where the report will be written, so that it can refer to the images
+            with relative paths (and still work once the report is moved together with the cache)
+    """
+    data = rules_graph.to_json()
+
+    if layouts:
+        groups = {group.id: group.parent for group in Group.groups.values()}
+        data['layout'] = layouts.layout(data['nodes'], data['edges'], groups)
+
+    if details_dir:
+        data['nodes'] = write_details(data['nodes'], Path(details_dir))
 
     json_dag = json.dumps({
-        'nodes': [
-            node.to_json()
-            for node in rules_dag.nodes
-        ],
-        'edges': [
-            {'from': edge[0].name, 'to': edge[1].name}
-            for edge in rules_dag.edges
-        ],
+        **data,
         'clusters': [
             cluster.to_json()
             for cluster in Group.groups.values()
@@ -36,6 +115,9 @@ def generate_graph(rules_dag, **kwargs):
     kwargs['json'] = json_dag
     kwargs = {
         'json': json_dag,
+        # the images are referenced by their hashes, and loaded from the store once displayed
+        'images_url': images_url(report_path),
+        'details_url': Path(details_dir).name if details_dir else ''
     }
 
     return render_template('graph.html', **kwargs)
@@ -0,0 +1,157 @@
+import json
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..utils import atomic_write
+
+
+# sizes of the boxes of the nodes (in pixels); these are fixed (the labels scroll if needed),
+# so that the layout does not depend on anything which changes between the runs (status, times, diffs...)
+NODE_SIZES = {
+    'notebook': (280, 170),
+    'io': (240, 50)
+}
+DEFAULT_NODE_SIZE = (200, 60)
+# graphviz takes the sizes of the nodes in inches, and returns the positions in points
+POINTS_PER_INCH = 72
+
+
+def node_size(node: dict) -> tuple:
+    return NODE_SIZES.get(node['type'], DEFAULT_NODE_SIZE)
+
+
+def layout_clusters(nodes: List[dict], groups: Dict[str, Optional[str]]) -> Dict[str, Optional[str]]:
+    """The clusters to draw (groups with any nodes, and their parents), mapped to their parents"""
+    clusters = {}
+    for node in nodes:
+        group = node.get('group')
+        while group and group not in clusters:
+            parent = groups.get(group)
+            clusters[group] = parent
+            group = parent
+    return clusters
+
+
+def structure_hash(nodes: List[dict], edges: List[dict], groups: Dict[str, Optional[str]]) -> str:
+    """Hash of everything the layout depends on (but not the attributes of the nodes)"""
+    structure = {
+        'nodes': sorted([node['name'], node_size(node), node.get('group') or ''] for node in nodes),
+        'edges': sorted([edge['from'], edge['to']] for edge in edges),
+        'clusters': sorted([group, parent or ''] for group, parent in layout_clusters(nodes, groups).items())
+    }
+    return sha256(json.dumps(structure, sort_keys=True).encode()).hexdigest()
+
+
+def compute_layout(nodes: List[dict], edges: List[dict], groups: Dict[str, Optional[str]]) -> dict:
+    """Lay the graph out with graphviz dot.
+
+    Returns: the positions of the centers and the sizes of the nodes and clusters,
+        and the control points of the edges (splines), with the origin at the top left corner
+    """
+    from pygraphviz import AGraph
+
+    graph = AGraph(directed=True, strict=False)
+    graph.node_attr.update(shape='box', fixedsize='true')
+
+    clusters = layout_clusters(nodes, groups)
+    # the subgraphs have to be looked up again once laid out (by the names of their parents)
+    cluster_names = {group: f'cluster_{i}' for i, group in enumerate(sorted(clusters))}
+    subgraphs = {}
+
+    def subgraph(group):
+        if group not in subgraphs:
+            parent = clusters[group]
+            container = subgraph(parent) if parent in clusters else graph
+            subgraphs[group] = container.add_subgraph(name=cluster_names[group], label=group)
+        return subgraphs[group]
+
+    for node in nodes:
+        width, height = node_size(node)
+        group = node.get('group')
+        container = subgraph(group) if group in clusters else graph
+        container.add_node(
+            node['name'],
+            width=width / POINTS_PER_INCH,
+            height=height / POINTS_PER_INCH
+        )
+
+    for edge in edges:
+        graph.add_edge(edge['from'], edge['to'])
+
+    graph.layout(prog='dot')
+
+    left, bottom, right, top = map(float, graph.graph_attr['bb'].split(','))
+
+    def point(text: str) -> List[float]:
+        x, y = text.split(',')[:2]
+        return [float(x) - left, top - float(y)]
+
+    def box(bb: str) -> dict:
+        x1, y1, x2, y2 = map(float, bb.split(','))
+        x, y = point(f'{(x1 + x2) / 2},{(y1 + y2) / 2}')
+        return {'x': x, 'y': y, 'width': x2 - x1, 'height': y2 - y1}
+
+    def laid_out_subgraph(group):
+        parent = clusters[group]
+        container = laid_out_subgraph(parent) if parent in clusters else graph
+        return container.get_subgraph(cluster_names[group])
+
+    layout_nodes = {}
+    for node in nodes:
+        width, height = node_size(node)
+        x, y = point(graph.get_node(node['name']).attr['pos'])
+        layout_nodes[node['name']] = {'x': x, 'y': y, 'width': width, 'height': height}
+
+    layout_edges = []
+    for edge in graph.edges():
+        points = []
+        end = None
+        # "e,x,y" is the tip of the arrow; the remaining points are the control points of the spline
+        for part in edge.attr['pos'].split():
+            if part.startswith('e,'):
+                end = point(part[2:])
+            elif not part.startswith('s,'):
+                points.append(point(part))
+        layout_edges.append({'from': str(edge[0]), 'to': str(edge[1]), 'points': points, 'end': end})
+
+    return {
+        'width': right - left,
+        'height': top - bottom,
+        'nodes': layout_nodes,
+        'edges': layout_edges,
+        'clusters': {
+            group: box(laid_out_subgraph(group).graph_attr['bb'])
+            for group in clusters
+        }
+    }
+
+
+class LayoutCache:
+    """The layouts of the graphs, keyed by the hashes of their structure,
+
+    so that the graph is only laid out again once the rules or their inputs or outputs change.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / f'{key}.json'
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads(self.path(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, layout: dict):
+        atomic_write(self.path(key), json.dumps(layout).encode())
+
+    def layout(self, nodes: List[dict], edges: List[dict], groups: Dict[str, Optional[str]]) -> dict:
+        key = structure_hash(nodes, edges, groups)
+        layout = self.get(key)
+        if layout is None:
+            layout = compute_layout(nodes, edges, groups)
+            self.put(key, layout)
+        return layout
@@ -1,10 +1,18 @@
-from os import system
-from tempfile import NamedTemporaryFile
+from hashlib import sha256
+from pathlib import Path
 import json
 from warnings import warn
 
+from ..utils import atomic_write
 
-def static_graph(rules_dag, options='{}'):
+
+def static_graph(rules_dag, options='{}', cache_dir: Path = None):
+    """Render the graph to SVG (in memory) with graphviz dot.
+
+    Args:
+        cache_dir: if given, the SVG is cached there by the hash of the DOT source,
+            so that it is not rendered again when nothing changed
+    """
     from networkx.drawing.nx_agraph import to_agraph
 
     graph = to_agraph(rules_dag)
@@ -26,17 +34,18 @@ def static_graph(rules_dag, options='{}'):
             for attr, value in items.items():
                 attributes[attr] = value
 
-    with NamedTemporaryFile(suffix='.dot') as dot_file:
-        graph.write(dot_file.name)
-        graph.clear()
+    cached = None
+    if cache_dir:
+        cached = Path(cache_dir) / f'{sha256(graph.string().encode()).hexdigest()}.svg'
+        if cached.exists():
+            graph.clear()
+            return cached.read_text()
 
-        with NamedTemporaryFile(mode='r', suffix='.svg') as temp_file:
-            status = system(f'dot -Tsvg {dot_file.name} -o {temp_file.name}')
-            assert status == 0
+    svg = graph.draw(format='svg', prog='dot').decode()
+    graph.clear()
 
-            svg = temp_file.read()
-            insert_after = 'xmlns:xlink="http://www.w3.org/1999/xlink">'
-            processed = svg.replace(insert_after, insert_after + """
+    insert_after = 'xmlns:xlink="http://www.w3.org/1999/xlink">'
+    processed = svg.replace(insert_after, insert_after + """
                 <style>
                 a:hover polygon {
                     fill: yellow;
@@ -44,4 +53,10 @@ def static_graph(rules_dag, options='{}'):
                 </style>
             """)
 
+    if cached:
+        # only the most recent graph is kept
+        for path in cached.parent.glob('*.svg'):
+            path.unlink()
+        atomic_write(cached, processed.encode())
+
     return processed
@@ -55,5 +55,6 @@ tqdm
 declarative_parser
 jinja2
 nbdime
+Pillow
 """.split('\n'),
     )
@@ -0,0 +1,18 @@
+from pytest import fixture
+
+from nbpipeline import rules
+from nbpipeline.rules import Rule
+
+
+@fixture(autouse=True)
+def restore_rule_settings():
+    """`Rule.setup()` changes the attributes of the class; do not let these leak to the other tests"""
+    saved = dict(vars(Rule))
+    root = rules.outlines.root
+    yield
+    for key in set(vars(Rule)) - set(saved):
+        delattr(Rule, key)
+    for key, value in saved.items():
+        if vars(Rule).get(key) is not value:
+            setattr(Rule, key, value)
+    rules.outlines.root = root
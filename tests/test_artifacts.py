@@ -0,0 +1,96 @@
+from nbpipeline.artifacts import ArtifactStore
+from nbpipeline.rules import Rule
+
+
+def test_store_and_restore(tmp_path):
+    store = ArtifactStore(tmp_path / 'store')
+
+    output_dir = tmp_path / 'outputs'
+    (output_dir / 'nested').mkdir(parents=True)
+    (output_dir / 'a.txt').write_text('a')
+    (output_dir / 'nested' / 'b.txt').write_text('b')
+    single_file = tmp_path / 'c.txt'
+    single_file.write_text('c')
+
+    directory_manifest = store.store(output_dir)
+    file_manifest = store.store(single_file)
+    assert set(directory_manifest) == {'a.txt', 'nested/b.txt'}
+    assert set(file_manifest) == {''}
+    assert store.store(tmp_path / 'missing') is None
+
+    # a fresh checkout on another machine
+    checkout = tmp_path / 'checkout'
+    assert store.restore(checkout / 'outputs', directory_manifest)
+    assert store.restore(checkout / 'c.txt', file_manifest)
+    assert (checkout / 'outputs' / 'nested' / 'b.txt').read_text() == 'b'
+    assert (checkout / 'c.txt').read_text() == 'c'
+
+    # restored as a copy, which can be modified without affecting the store
+    assert (checkout / 'c.txt').stat().st_nlink == 1
+    (checkout / 'c.txt').write_text('changed')
+    assert store.object_path(file_manifest['']).read_text() == 'c'
+
+    store.save_record('abc', {'outputs': {'c.txt': file_manifest}})
+    assert ArtifactStore(tmp_path / 'store').load_record('abc') == {'outputs': {'c.txt': file_manifest}}
+    assert store.load_record('xyz') is None
+
+
+def test_restore_missing_object(tmp_path):
+    store = ArtifactStore(tmp_path / 'store', hardlinks=False)
+    assert not store.restore(tmp_path / 'x.txt', {'': 'f' * 32})
+    assert not (tmp_path / 'x.txt').exists()
+
+
+def test_restore_with_hardlinks(tmp_path):
+    store = ArtifactStore(tmp_path / 'store', hardlinks=True)
+    output = tmp_path / 'c.txt'
+    output.write_text('c')
+    manifest = store.store(output)
+    output.unlink()
+
+    assert store.restore(output, manifest)
+    # needs to be detached before being overwritten
+    assert output.stat().st_nlink == 2
+    store.detach(output)
+    output.write_text('changed')
+    assert store.object_path(manifest['']).read_text() == 'c'
+
+    # an object modified through a hardlink (bypassing detach) is not restored
+    output.unlink()
+    assert store.restore(output, manifest)
+    store.object_path(manifest['']).chmod(0o644)
+    output.write_text('corrupted')
+    assert not store.restore(tmp_path / 'elsewhere.txt', manifest)
+    assert not store.object_path(manifest['']).exists()
+
+
+def test_restore_over_other_files(tmp_path):
+    store = ArtifactStore(tmp_path / 'store')
+    output = tmp_path / 'outputs'
+    (output / 'nested').mkdir(parents=True)
+    (output / 'nested' / 'b.txt').write_text('b')
+    directory_manifest = store.store(output)
+    single_file = tmp_path / 'c.txt'
+    single_file.write_text('c')
+    file_manifest = store.store(single_file)
+
+    # stale files are removed from the directories
+    (output / 'stale.txt').write_text('stale')
+    (output / 'nested' / 'stale.txt').write_text('stale')
+    assert store.restore(output, directory_manifest)
+    assert sorted(path.relative_to(output).as_posix() for path in output.rglob('*')) == ['nested', 'nested/b.txt']
+
+    # a directory where a file was, and the other way around
+    assert store.restore(output, file_manifest)
+    assert output.read_text() == 'c'
+    assert store.restore(output, directory_manifest)
+    assert (output / 'nested' / 'b.txt').read_text() == 'b'
+
+
+def test_artifacts_store_opt_in(tmp_path):
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp')
+    assert Rule.artifacts is None
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp', artifacts_dir='none')
+    assert Rule.artifacts is None
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp', artifacts_dir=tmp_path / 'artifacts')
+    assert Rule.artifacts.root == tmp_path / 'artifacts'
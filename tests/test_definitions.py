@@ -0,0 +1,26 @@
+import os
+
+from nbpipeline.definitions import DefinitionIndex, stat_files
+
+
+def test_definition_index(tmp_path):
+    notebook = tmp_path / 'notebook.ipynb'
+    notebook.write_text('{}')
+    included = tmp_path / 'included.ipynb'
+    included.write_text('{}')
+
+    files = stat_files([notebook, included])
+    assert stat_files([notebook, tmp_path / 'missing.ipynb']) is None
+
+    index = DefinitionIndex(tmp_path / 'definitions.sqlite')
+    index.put('key', files, {'inputs': {'a': 'a.csv'}})
+    assert index.get('key') == {'inputs': {'a': 'a.csv'}}
+    assert index.get('other key') is None
+
+    # persists between the processes
+    assert DefinitionIndex(tmp_path / 'definitions.sqlite').get('key') == {'inputs': {'a': 'a.csv'}}
+
+    # changes of the included files invalidate the entry
+    stat = included.stat()
+    os.utime(included, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert index.get('key') is None
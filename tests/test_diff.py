@@ -0,0 +1,61 @@
+import os
+
+from nbpipeline.diff import DiffCache, diff_key, diff_notebooks
+
+
+def notebook(output, execution_count=1, metadata=None):
+    return {
+        'metadata': metadata or {},
+        'cells': [
+            {
+                'cell_type': 'code',
+                'source': 'print(1)',
+                'execution_count': execution_count,
+                'metadata': metadata or {},
+                'outputs': [{'output_type': 'stream', 'name': 'stdout', 'text': output}]
+            }
+        ]
+    }
+
+
+def test_diff_notebooks():
+    from nbdime.diffing.notebooks import diff_notebooks as nbdime_diff_notebooks
+    from nbformat import from_dict
+    reference = from_dict(notebook('1\n'))
+    rerun = from_dict(notebook('1\n', execution_count=2, metadata={'duration': 1}))
+    assert diff_notebooks(reference, rerun) == []
+    assert diff_notebooks(reference, from_dict(notebook('2\n'))) != []
+    # the global configuration of nbdime is not changed
+    assert nbdime_diff_notebooks(reference, rerun) != []
+
+
+def test_diff_key():
+    reference = notebook('1\n')
+    key = diff_key(reference, notebook('1\n'), 'a.ipynb')
+    # execution times and counts do not matter
+    assert key == diff_key(reference, notebook('1\n', execution_count=2, metadata={'duration': 1}), 'a.ipynb')
+    # but the outputs do
+    assert key != diff_key(reference, notebook('2\n'), 'a.ipynb')
+    assert key != diff_key(reference, notebook('1\n'), 'b.ipynb')
+
+
+def test_diff_cache_eviction(tmp_path):
+    cache = DiffCache(tmp_path, max_size=0)
+    cache.put('a', {'diff': []})
+    # everything above the limit is evicted
+    assert cache.get('a') is None
+
+    cache.max_size = 10 ** 6
+    for key in 'abc':
+        cache.put(key, {'text_diff': 'x' * 1000})
+    os.utime(cache.path('a'), (0, 0))
+    os.utime(cache.path('b'), (1, 1))
+    os.utime(cache.path('c'), (2, 2))
+    # using "a" makes "b" the least recently used one
+    assert cache.get('a') == {'text_diff': 'x' * 1000}
+
+    cache.max_size = 2 * cache.path('a').stat().st_size
+    cache.evict()
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
@@ -0,0 +1,11 @@
+from nbpipeline.execution import papermill_parameter
+
+
+def test_papermill_parameter():
+    assert papermill_parameter('True') is True
+    assert papermill_parameter('None') is None
+    assert papermill_parameter(1) == 1 and isinstance(papermill_parameter('1'), int)
+    assert papermill_parameter('0.5') == 0.5
+    assert papermill_parameter('1e3') == 1000.0
+    assert papermill_parameter('data/input.csv') == 'data/input.csv'
+    assert papermill_parameter('true') == 'true'
@@ -0,0 +1,28 @@
+from subprocess import check_call
+
+from nbpipeline.version_control.git import Repository
+
+
+def test_repository(tmp_path):
+    def git(*arguments):
+        check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *arguments], cwd=tmp_path)
+
+    (tmp_path / 'analyses').mkdir()
+    notebook = tmp_path / 'analyses' / 'a.ipynb'
+    untracked = tmp_path / 'analyses' / 'b.ipynb'
+    git('init', '-q')
+    for content in ['{}', '{"cells": []}']:
+        notebook.write_text(content)
+        git('add', 'analyses/a.ipynb')
+        git('commit', '-q', '-m', 'change')
+    untracked.write_text('{}')
+
+    repository = Repository(tmp_path / 'analyses')
+    assert repository.tracked_files == {'a.ipynb'}
+    assert repository.is_tracked(notebook)
+    assert not repository.is_tracked(untracked)
+    assert repository.recent_changes(notebook) == 2
+    assert repository.recent_changes(untracked) == 0
+
+    # not a repository
+    assert not Repository(tmp_path.parent).tracked_files
@@ -0,0 +1,183 @@
+import os
+from pathlib import Path
+
+from pytest import raises
+
+from nbpipeline.graph import RulesGraph
+from nbpipeline.rules import ShellRule, Rule
+
+
+def test_iterate_rules_order():
+    rules = [
+        ShellRule('order: last', command='true', input={'a': 'order/b.txt', 'b': 'order/c.txt'}),
+        ShellRule('order: second', command='true', input={'a': 'order/a.txt'}, output={'b': 'order/b.txt'}),
+        ShellRule('order: first', command='true', output={'a': 'order/a.txt'}),
+        ShellRule('order: independent', command='true', output={'c': 'order/c.txt'}),
+    ]
+    graph = RulesGraph({rule.name: rule for rule in rules})
+    order = [rule.name for rule in graph.iterate_rules()]
+    assert len(order) == 4
+    assert order.index('order: first') < order.index('order: second') < order.index('order: last')
+    assert order.index('order: independent') < order.index('order: last')
+    assert graph.find_cycle() == []
+
+
+def test_cycle_detection():
+    rules = [
+        ShellRule('cycle: a', command='true', input={'x': 'cycle/c.txt'}, output={'x': 'cycle/a.txt'}),
+        ShellRule('cycle: b', command='true', input={'x': 'cycle/a.txt'}, output={'x': 'cycle/b.txt'}),
+        ShellRule('cycle: c', command='true', input={'x': 'cycle/b.txt', 'y': 'cycle/d.txt'}, output={'x': 'cycle/c.txt'}),
+        # a shorter cycle: c <-> d
+        ShellRule('cycle: d', command='true', input={'x': 'cycle/c.txt'}, output={'x': 'cycle/d.txt'}),
+        ShellRule('cycle: downstream', command='true', input={'x': 'cycle/d.txt'}),
+    ]
+    graph = RulesGraph({rule.name: rule for rule in rules})
+
+    # the shortest one, starting from its first node (in the order of the graph)
+    assert [node.name for node in graph.find_cycle()] == ['cycle/c.txt', 'cycle: d', 'cycle/d.txt', 'cycle: c']
+
+    with raises(ValueError, match='cycle detected: '):
+        graph.iterate_rules()
+
+
+def test_outdated_rules(tmp_path):
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp')
+    raw, clean, report, summary = [(tmp_path / name).as_posix() for name in ['raw', 'clean', 'report', 'summary']]
+    rules = [
+        ShellRule('make: clean', command='true', input={'x': raw}, output={'x': clean}),
+        ShellRule('make: report', command='true', input={'x': clean}, output={'x': report}),
+        ShellRule('make: summary', command='true', input={'x': report}, output={'x': summary}),
+    ]
+    graph = RulesGraph({rule.name: rule for rule in rules})
+
+    for i, path in enumerate([raw, clean, report]):
+        Path(path).write_text('')
+        os.utime(path, ns=(i * 10 ** 9, i * 10 ** 9))
+
+    assert graph.outdated_rules() == {rules[2]: f'missing output {summary}'}
+
+    Path(summary).write_text('')
+    assert graph.outdated_rules() == {}
+
+    os.utime(raw, ns=(5 * 10 ** 9, 5 * 10 ** 9))
+    assert graph.outdated_rules() == {
+        rules[0]: f'newer input {raw}',
+        rules[1]: "upstream rule 'make: clean' will run",
+        rules[2]: "upstream rule 'make: report' will run"
+    }
+
+
+def test_select_rules():
+    rules = [
+        ShellRule('select: extract', command='true', output={'x': 'select/clean.csv'}, group='select/data'),
+        ShellRule('select: report', command='true', input={'x': 'select/clean.csv'}, output={'x': 'select/report.csv'}),
+        ShellRule('select: plot', command='true', input={'x': 'select/clean.csv'}, output={'x': 'select/plot.png'}),
+        ShellRule('select: unrelated', command='true', output={'x': 'select/other.csv'}, group='select/data'),
+    ]
+    extract, report, plot, unrelated = rules
+    graph = RulesGraph({rule.name: rule for rule in rules})
+
+    assert graph.select_rules(targets=['select/report.csv']) == {extract, report}
+    assert graph.select_rules(until=['select: plot']) == {extract, plot}
+    assert graph.select_rules(groups=['select/data']) == {extract, unrelated}
+    assert graph.downstream_rules(['select: extract']) == {extract, report, plot}
+
+    with raises(ValueError, match='Unknown target'):
+        graph.select_rules(targets=['select/missing.csv'])
+
+
+def test_input_output_preview(tmp_path):
+    from nbpipeline.graph import InputOutputNode
+    from nbpipeline.previews import read_head
+    path = tmp_path / 'table.csv'
+    path.write_text('a,b\n' + ''.join(f'{i},{i}\n' for i in range(10000)))
+
+    node = InputOutputNode(path.as_posix(), group=None)
+    assert list(node.head.columns) == ['a', 'b']
+    assert len(node.head) == 10
+    assert '<table' in node.preview and '<td>9</td>' in node.preview
+
+    # only the beginning of the file (up to the last complete line) is read
+    assert len(read_head(path, max_bytes=18)) == 3
+
+    assert read_head(tmp_path / 'missing.csv').empty
+
+
+def test_producers_and_consumers():
+    rules = [
+        ShellRule('index: first', command='true', output={'a': 'index/a.txt'}),
+        ShellRule('index: second', command='true', input={'a': 'index/a.txt'}, output={'b': 'index/b.txt'}),
+        ShellRule('index: third', command='true', input={'a': 'index/a.txt', 'b': 'index/b.txt'}),
+    ]
+    first, second, third = rules
+    graph = RulesGraph({rule.name: rule for rule in rules})
+
+    assert graph.producers == {'index/a.txt': first, 'index/b.txt': second}
+    assert graph.consumers == {'index/a.txt': {second, third}, 'index/b.txt': {third}}
+
+
+def test_incremental_update(monkeypatch):
+    rules = [
+        ShellRule('update: first', command='true', output={'a': 'update/a.txt'}),
+        ShellRule('update: second', command='true', input={'a': 'update/a.txt'}, output={'b': 'update/b.txt'}),
+    ]
+    first, second = rules
+    graph = RulesGraph({rule.name: rule for rule in rules})
+
+    serialized = []
+    original_to_json = ShellRule.to_json
+
+    def to_json(rule):
+        serialized.append(rule)
+        return original_to_json(rule)
+
+    monkeypatch.setattr(ShellRule, 'to_json', to_json)
+
+    data = graph.to_json()
+    assert {node['name'] for node in data['nodes']} == {
+        'update: first', 'update: second', 'update/a.txt', 'update/b.txt'
+    }
+    assert {'from': 'update: first', 'to': 'update/a.txt'} in data['edges']
+    assert set(serialized) == {first, second}
+
+    # nothing changed: nothing is re-computed
+    serialized.clear()
+    graph.to_json()
+    assert serialized == []
+
+    # only the rule which changed is re-computed
+    second.status = 1
+    graph.update(second)
+    dag = graph.refresh()
+    assert set(serialized) == {second}
+    assert dag.nodes[second]['status'] == 1
+    assert dag.nodes[first]['status'] is None
+    assert graph.io_nodes['update/b.txt'] in dag and not graph.outdated
+
+
+def test_outdated_rules_hardlinks(tmp_path):
+    Rule.setup(
+        cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp', artifacts_dir=tmp_path / 'artifacts', hardlinks=True
+    )
+    raw, clean = [(tmp_path / name).as_posix() for name in ['raw', 'clean']]
+    rule = ShellRule('hardlinks: clean', command='true', input={'x': raw}, output={'x': clean})
+    graph = RulesGraph({rule.name: rule})
+
+    Path(clean).write_text('clean')
+    manifest = Rule.artifacts.store(Path(clean))
+    stored = Rule.artifacts.object_path(manifest[''])
+    os.utime(stored, ns=(10 ** 9, 10 ** 9))
+    Path(clean).unlink()
+    Path(raw).write_text('')
+    os.utime(raw, ns=(2 * 10 ** 9, 2 * 10 ** 9))
+
+    # restored with a hardlink: the stored object is not touched, but the output counts as new
+    assert Rule.artifacts.restore(Path(clean), manifest)
+    assert Path(clean).stat().st_nlink == 2
+    assert stored.stat().st_mtime_ns == 10 ** 9
+    assert graph.outdated_rules() == {}
+
+    # until modified
+    Rule.artifacts.detach(Path(clean))
+    os.utime(clean, ns=(10 ** 9, 10 ** 9))
+    assert graph.outdated_rules() == {rule: f'newer input {raw}'}
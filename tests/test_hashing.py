@@ -0,0 +1,51 @@
+import os
+
+from nbpipeline import hashing
+from nbpipeline.hashing import HashIndex, hash_content
+
+
+def test_hash_content(tmp_path):
+    empty = tmp_path / 'empty.txt'
+    empty.write_bytes(b'')
+    a = tmp_path / 'a.txt'
+    a.write_bytes(b'a' * 10)
+    b = tmp_path / 'b.txt'
+    b.write_bytes(b'a' * 10)
+    assert hash_content(a) == hash_content(b) != hash_content(empty)
+
+
+def test_hash_index(tmp_path, monkeypatch):
+    path = tmp_path / 'data.csv'
+    path.write_text('a,b\n1,2\n')
+    index = HashIndex(tmp_path / 'index.sqlite')
+    digest = index.hash(path)
+
+    reads = []
+    monkeypatch.setattr(hashing, 'hash_content', lambda path: reads.append(path) or 'from disk')
+
+    # the index persists between the processes and unchanged files are not read again
+    assert HashIndex(tmp_path / 'index.sqlite').hash(path) == digest
+    assert not reads
+
+    stat = path.stat()
+    path.write_text('a,b\n1,3\n')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert index.hash(path) == 'from disk'
+    assert len(reads) == 1
+
+
+def test_hash_file_algorithm(tmp_path, monkeypatch):
+    from nbpipeline.artifacts import ArtifactStore
+    monkeypatch.setattr(hashing, 'index', None)
+    path = tmp_path / 'data.csv'
+    path.write_text('a,b\n1,2\n')
+
+    digest = hashing.hash_file(path)
+    assert digest == f'{hashing.ALGORITHM}:{hash_content(path)}'
+
+    # digests computed with another algorithm (e.g. on a machine without xxhash) never match
+    monkeypatch.setattr(hashing, 'ALGORITHM', 'other')
+    other = hashing.hash_file(path)
+    assert other != digest
+    store = ArtifactStore(tmp_path / 'store')
+    assert store.object_path(digest) != store.object_path(other)
@@ -0,0 +1,23 @@
+from base64 import b64encode
+
+from nbpipeline.images import ImageStore
+
+# 1x1 transparent pixel
+PIXEL = (
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+
+def test_image_store(tmp_path):
+    store = ImageStore(tmp_path / 'images')
+    digest = store.store(PIXEL)
+    assert store.is_digest(digest)
+    assert not store.is_digest(PIXEL)
+    assert b64encode(store.image_path(digest).read_bytes()).decode() == PIXEL
+    assert store.thumbnail_path(digest).exists()
+
+    # the same image is stored only once
+    modified = store.image_path(digest).stat().st_mtime_ns
+    assert store.store(PIXEL) == digest
+    assert store.image_path(digest).stat().st_mtime_ns == modified
+    assert len([path for path in (tmp_path / 'images').rglob('*.png')]) == 2
@@ -0,0 +1,48 @@
+import json
+
+from nbpipeline.images import ImageStore
+from nbpipeline.rules import Rule
+from nbpipeline.visualization.interactive_graph import images_url, write_details
+
+
+def test_write_details(tmp_path):
+    nodes = [
+        {
+            'name': 'Analysis', 'type': 'notebook', 'status': 0,
+            'text_diff': '<table>' + 'x' * 1000 + '</table>', 'images': ['a' * 64], 'todos': ['TODO'], 'headers': []
+        },
+        {'name': 'data/table.csv', 'type': 'io', 'head': '<table></table>', 'exists': True}
+    ]
+    directory = tmp_path / 'graph_details'
+
+    summaries = write_details(nodes, directory)
+
+    analysis, table = summaries
+    assert analysis['status'] == 0 and 'text_diff' not in analysis
+    assert analysis['images_count'] == 1 and analysis['todos_count'] == 1
+    assert table['exists'] and 'head' not in table
+
+    shard = (directory / f"{analysis['details']}.js").read_text()
+    assert shard.startswith(f"report_details(\"{analysis['details']}\", ")
+    assert json.loads(shard[shard.index(', ') + 2:-2])['images'] == ['a' * 64]
+    # the preview of the file is loaded once the file node is opened
+    shard = (directory / f"{table['details']}.js").read_text()
+    assert json.loads(shard[shard.index(', ') + 2:-2])['head'] == '<table></table>'
+
+    # unchanged details are not written again, and the unused ones are removed
+    modified = (directory / f"{table['details']}.js").stat().st_mtime_ns
+    nodes[0]['text_diff'] = ''
+    new_analysis, new_table = write_details(nodes, directory)
+    assert new_table['details'] == table['details']
+    assert (directory / f"{table['details']}.js").stat().st_mtime_ns == modified
+    assert new_analysis['details'] != analysis['details']
+    assert {path.stem for path in directory.iterdir()} == {new_analysis['details'], table['details']}
+
+
+def test_images_url(tmp_path, monkeypatch):
+    monkeypatch.setattr(Rule, 'image_store', ImageStore(tmp_path / 'cache' / 'images'))
+
+    # relative to the report, so that it can be moved (or served) together with the cache
+    assert images_url(tmp_path / 'report' / 'graph.html') == '../cache/images'
+    assert images_url(tmp_path / 'graph.html') == 'cache/images'
+    assert images_url() == (tmp_path / 'cache' / 'images').as_uri()
@@ -0,0 +1,68 @@
+from pytest import importorskip
+
+from nbpipeline.visualization import layout
+from nbpipeline.visualization.layout import LayoutCache, structure_hash
+
+
+def pipeline(status=None):
+    nodes = [
+        {'name': 'Analysis', 'type': 'notebook', 'group': 'analyses', 'status': status},
+        {'name': 'data/input.csv', 'type': 'io', 'group': 'analyses'},
+        {'name': 'data/output.csv', 'type': 'io', 'group': 'analyses'}
+    ]
+    edges = [
+        {'from': 'data/input.csv', 'to': 'Analysis'},
+        {'from': 'Analysis', 'to': 'data/output.csv'}
+    ]
+    return nodes, edges, {'analyses': 'project', 'project': None, 'unused': None}
+
+
+def test_structure_hash():
+    nodes, edges, groups = pipeline()
+    key = structure_hash(nodes, edges, groups)
+
+    # the attributes of the nodes and the order do not matter
+    assert structure_hash(*pipeline(status=1)) == key
+    assert structure_hash(nodes[::-1], edges[::-1], groups) == key
+    # nor the groups without any nodes
+    assert structure_hash(nodes, edges, {**groups, 'other': None}) == key
+
+    assert structure_hash(nodes, edges[:1], groups) != key
+    assert structure_hash(nodes, edges, {**groups, 'analyses': None}) != key
+
+
+def test_layout_cache(tmp_path, monkeypatch):
+    computed = []
+
+    def compute_layout(nodes, edges, groups):
+        computed.append(nodes)
+        return {'nodes': {node['name']: {'x': 0, 'y': 0} for node in nodes}}
+
+    monkeypatch.setattr(layout, 'compute_layout', compute_layout)
+    cache = LayoutCache(tmp_path / 'layouts')
+
+    first = cache.layout(*pipeline())
+    # only the status changed: the layout is reused
+    assert cache.layout(*pipeline(status=0)) == first
+    assert len(computed) == 1
+
+    nodes, edges, groups = pipeline()
+    cache.layout(nodes + [{'name': 'data/other.csv', 'type': 'io'}], edges, groups)
+    assert len(computed) == 2
+
+
+def test_compute_layout():
+    importorskip('pygraphviz')
+    nodes, edges, groups = pipeline()
+
+    result = layout.compute_layout(nodes, edges, groups)
+
+    positions = result['nodes']
+    assert positions['data/input.csv']['y'] < positions['Analysis']['y'] < positions['data/output.csv']['y']
+    assert positions['Analysis']['width'] == 280
+    assert {(edge['from'], edge['to']) for edge in result['edges']} == {
+        ('data/input.csv', 'Analysis'), ('Analysis', 'data/output.csv')
+    }
+    assert set(result['clusters']) == {'analyses', 'project'}
+    project, analyses = result['clusters']['project'], result['clusters']['analyses']
+    assert project['width'] >= analyses['width'] and project['height'] >= analyses['height']
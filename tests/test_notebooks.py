@@ -0,0 +1,144 @@
+import json
+import os
+
+from pytest import raises
+
+from nbpipeline.notebooks import read_notebook, read_outline
+
+
+def code_cell(source, outputs, tags=()):
+    return {
+        'cell_type': 'code',
+        'execution_count': 1,
+        'metadata': {'tags': list(tags)} if tags else {},
+        'outputs': outputs,
+        'source': source
+    }
+
+
+IMAGE = {
+    'output_type': 'display_data',
+    'data': {'image/png': 'iVBORw0KGgo' * 10000, 'text/plain': ['<Figure with "quotes" and \\ escapes>']},
+    'metadata': {'needs_background': 'light'}
+}
+
+PATHS = {
+    'output_type': 'display_data',
+    'data': {'text/html': ['']},
+    'metadata': {'table': 'data/table.csv'}
+}
+
+
+def test_read_outline(tmp_path):
+    path = tmp_path / 'notebook.ipynb'
+    notebook = {
+        'cells': [
+            {'cell_type': 'markdown', 'metadata': {}, 'source': ['# Header']},
+            code_cell(['plot()'], [IMAGE, {'output_type': 'stream', 'name': 'stdout', 'text': ['[]{}\n', 'C:\\']}]),
+            code_cell(['__outputs__ = create_paths(...)'], [PATHS], tags=['outputs']),
+        ],
+        'metadata': {'kernelspec': {'name': 'python3'}},
+        'nbformat': 4,
+        'nbformat_minor': 4
+    }
+    path.write_text(json.dumps(notebook, indent=1))
+    assert read_notebook(path) == notebook
+
+    outline = read_outline(path)
+    assert outline['metadata'] == notebook['metadata']
+    assert [cell['source'] for cell in outline['cells']] == [['# Header'], ['plot()'], ['__outputs__ = create_paths(...)']]
+    # outputs are skipped, other than the metadata of outputs of the tagged cells
+    assert 'outputs' not in outline['cells'][1]
+    assert outline['cells'][2]['outputs'] == [{'output_type': 'display_data', 'metadata': {'table': 'data/table.csv'}}]
+
+    # the order of keys does not matter
+    cell = notebook['cells'][2]
+    notebook['cells'][2] = {'outputs': cell['outputs'], 'source': cell['source'], 'metadata': cell['metadata']}
+    path.write_text(json.dumps(notebook))
+    assert read_outline(path)['cells'][2]['outputs'] == [{'output_type': 'display_data', 'metadata': {'table': 'data/table.csv'}}]
+
+
+def test_read_outline_invalid(tmp_path):
+    path = tmp_path / 'notebook.ipynb'
+    path.write_text('')
+    with raises(ValueError):
+        read_outline(path)
+    path.write_text('{"cells": [{"source": "x"}')
+    with raises(ValueError):
+        read_outline(path)
+
+
+def test_include_resolver(tmp_path):
+    from nbpipeline.notebooks import IncludeResolver
+
+    def write(name, *sources):
+        path = tmp_path / name
+        path.write_text(json.dumps({'cells': [code_cell(source, []) for source in sources], 'metadata': {}}))
+        return path.as_posix()
+
+    helpers = write('helpers.ipynb', ['def helper(): pass'])
+    shared = write('shared.ipynb', [f'%run {helpers}\n', 'import os'])
+
+    loaded = []
+
+    def load(path):
+        loaded.append(path)
+        return read_notebook(path)
+
+    resolver = IncludeResolver(load)
+    notebook = {'cells': [code_cell(['x = 1\n', f'%run {shared}\n', 'y = 2'], [])]}
+    expanded = resolver.expand(notebook)
+    assert [cell['source'] for cell in expanded['cells']] == [
+        ['x = 1\n'], ['def helper(): pass'], ['import os'], ['y = 2']
+    ]
+    assert resolver.dependencies(notebook)[0][0] == shared
+    assert {path for path, _, _ in resolver.dependencies(notebook)} == {shared, helpers}
+
+    # included notebooks are read once and their cells are shared
+    again = resolver.expand({'cells': [code_cell([f'%run {shared}'], [])]})
+    assert again['cells'][0] is expanded['cells'][1]
+    assert len(loaded) == 2
+
+    # unless any of the (nested) included files changed
+    write('helpers.ipynb', ['def helper(): return 1'])
+    stat = (tmp_path / 'helpers.ipynb').stat()
+    os.utime(tmp_path / 'helpers.ipynb', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert resolver.expand(notebook)['cells'][1]['source'] == ['def helper(): return 1']
+
+    write('helpers.ipynb', [f'%run {shared}'])
+    with raises(ValueError, match='cycle detected'):
+        IncludeResolver().expand(notebook)
+
+
+def test_strip_outputs():
+    from nbpipeline.notebooks import strip_outputs
+    notebook = {
+        'cells': [
+            {'cell_type': 'markdown', 'metadata': {}, 'source': ['# Header']},
+            code_cell(['plot()'], [IMAGE])
+        ],
+        'metadata': {}
+    }
+    stripped = strip_outputs(notebook)
+    assert stripped['cells'][1] == code_cell(['plot()'], [])
+    # the original is not modified
+    assert notebook['cells'][1]['outputs'] == [IMAGE]
+
+    # the outline is enough to produce the stripped notebook
+    for path in ['tests/Simple_input_output.ipynb', 'tests/Data_vault_io.ipynb']:
+        assert strip_outputs(read_outline(path)) == strip_outputs(read_notebook(path))
+
+
+def test_read_images(tmp_path):
+    from nbpipeline.notebooks import read_images
+    path = tmp_path / 'notebook.ipynb'
+    notebook = {
+        'cells': [
+            code_cell(['plot()'], [IMAGE, PATHS]),
+            {'cell_type': 'markdown', 'metadata': {}, 'source': ['# Header']},
+            code_cell(['plot()'], [{**IMAGE, 'data': {'image/png': 'second'}}])
+        ],
+        'metadata': {}
+    }
+    path.write_text(json.dumps(notebook))
+    assert list(read_images(path)) == [IMAGE['data']['image/png'], 'second']
@@ -0,0 +1,31 @@
+import os
+
+from nbpipeline import previews
+from nbpipeline.previews import PreviewCache
+
+
+def test_preview_cache(tmp_path, monkeypatch):
+    rendered = []
+
+    def render_preview(path, rows, max_bytes):
+        rendered.append(path)
+        return f'<table>{path.name}</table>'
+
+    monkeypatch.setattr(previews, 'render_preview', render_preview)
+    a = tmp_path / 'a.csv'
+    b = tmp_path / 'b.csv'
+    for path in [a, b]:
+        path.write_text('x\n1\n')
+
+    cache = PreviewCache(tmp_path / 'previews.sqlite')
+    assert cache.previews([a, b]) == {a: '<table>a.csv</table>', b: '<table>b.csv</table>'}
+    assert len(rendered) == 2
+
+    # the cache persists between the processes and unchanged files are not read again
+    assert PreviewCache(tmp_path / 'previews.sqlite').preview(a) == '<table>a.csv</table>'
+    assert len(rendered) == 2
+
+    stat = a.stat()
+    os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cache.preview(a)
+    assert rendered[2:] == [a]
@@ -1,14 +1,21 @@
+import json
+import os
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 
-from pytest import warns
+from pytest import raises, warns
 from pandas import read_csv
 
 from nbpipeline.nbpipeline import Pipeline
+from nbpipeline.notebooks import read_outline
 from nbpipeline.rules import NotebookRule, expand_run_magics, Rule
 from nbpipeline.version_control.git import deduce_web_url
 
-Rule.setup(cache_dir=Pipeline.cache_dir.default, tmp_dir=Pipeline.tmp_dir.default)
+Rule.setup(
+    cache_dir=Pipeline.cache_dir.default,
+    tmp_dir=Pipeline.tmp_dir.default,
+    artifacts_dir=Path(Pipeline.cache_dir.default) / 'artifacts'
+)
 
 
 def test_notebook_rule_fail():
@@ -47,6 +54,9 @@ def test_notebook_rule_parameters(capsys):
 
     assert (result == reference).all().all()
     assert rule.outputs == {'output_file': result_path.as_posix()}
+    assert rule.fidelity is not None
+    assert isinstance(rule.diff, list)
+    assert '<html>' in rule.text_diff
 
     # test cache:
     _ = capsys.readouterr()
@@ -55,6 +65,14 @@ def test_notebook_rule_parameters(capsys):
     assert status_code == 0
     assert f'Reusing cached results for {rule}' in captured.out
 
+    # outputs are restored from the artifacts store
+    result_path.unlink()
+    status_code = rule.run(use_cache=True)
+    captured = capsys.readouterr()
+    assert status_code == 0
+    assert f'Reusing cached results for {rule}' in captured.out
+    assert (read_csv(result_path) == reference).all().all()
+
 
 def test_notebook_rule_skip_execute():
     rule = NotebookRule(
@@ -70,6 +88,11 @@ def test_notebook_rule_skip_execute():
     assert status_code == 0
     assert rule.execution_time is None
 
+    # the stripped notebook has no outputs, while the notebook itself is unchanged
+    stripped = json.loads((rule.stripped_nb_dir / 'tests' / 'Simple_input_output.ipynb').read_text())
+    assert all(cell['outputs'] == [] for cell in stripped['cells'] if cell['cell_type'] == 'code')
+    assert any(cell.get('outputs') for cell in rule.notebook_json['cells'])
+
 
 def test_notebook_rule_data_vault():
     with warns(
@@ -184,3 +207,278 @@ def test_repository_url():
     assert deduce_web_url('git@github.com:krassowski/nbpipeline.git') == 'https://github.com/krassowski/nbpipeline'
     assert deduce_web_url('https://github.com/krassowski/nbpipeline.git') == 'https://github.com/krassowski/nbpipeline'
     assert deduce_web_url('ssh://git@github.com/krassowski/nbpipeline') == 'https://github.com/krassowski/nbpipeline'
+
+
+def test_cache_key(tmp_path):
+    input_path = tmp_path / 'input.csv'
+    input_path.write_text('a,b\n1,2\n')
+
+    def key(name, notebook='tests/Simple_input_output.ipynb', **kwargs):
+        rule = NotebookRule(
+            name,
+            notebook=notebook,
+            input={'input_file': input_path.as_posix()},
+            output={'output_file': 'tests/test_output.csv'},
+            **kwargs
+        )
+        return rule.cache_key()
+
+    reference = key('Cache key')
+    assert key('Cache key (same)') == reference
+    assert key('Cache key (parameters)', parameters={'x': 1}) != reference
+
+    # outputs and execution counts do not matter
+    with open('tests/Simple_input_output.ipynb') as f:
+        notebook = json.load(f)
+    for cell in notebook['cells']:
+        if cell['cell_type'] == 'code':
+            cell['outputs'] = [{'output_type': 'stream', 'name': 'stdout', 'text': ['changed']}]
+            cell['execution_count'] = 100
+    executed_notebook = tmp_path / 'executed.ipynb'
+    executed_notebook.write_text(json.dumps(notebook))
+    assert key('Cache key (executed)', notebook=executed_notebook.as_posix()) == reference
+
+    # but the content of the inputs does
+    input_path.write_text('a,b\n1,3\n')
+    assert key('Cache key (changed input)') != reference
+
+
+def test_notebook_rule_kernel_pool(monkeypatch):
+    monkeypatch.setattr(Rule, 'kernel_pool', 1)
+    monkeypatch.setattr(Rule, 'preload', ['json'])
+    result_path = Path('tests/test_output_pool.csv')
+    if result_path.exists():
+        result_path.unlink()
+
+    rule = NotebookRule(
+        'Simple I/O (kernel pool)',
+        notebook='tests/Simple_input_output.ipynb',
+        input={'input_file': 'tests/input.csv'},
+        output={'output_file': result_path.as_posix()},
+    )
+    assert rule.run(use_cache=False) == 0
+    assert (read_csv(result_path) == read_csv('tests/output.csv')).all().all()
+    result_path.unlink()
+
+    failing_rule = NotebookRule(
+        'Simple I/O failure (kernel pool)',
+        notebook='tests/Simple_input_output.ipynb',
+        input={'input_file': 'xxx.csv'}
+    )
+    assert failing_rule.run(use_cache=False) != 0
+
+
+def test_notebook_rule_deferred_diff(monkeypatch):
+    monkeypatch.setattr(Rule, 'defer_diffs', True)
+    result_path = Path('tests/test_output_deferred.csv')
+
+    rule = NotebookRule(
+        'Simple I/O (deferred diff)',
+        notebook='tests/Simple_input_output.ipynb',
+        input={'input_file': 'tests/input.csv'},
+        output={'output_file': result_path.as_posix()},
+    )
+    assert rule.run(use_cache=False) == 0
+    result_path.unlink()
+    assert rule.diff is None and rule.fidelity is None
+    assert rule.pending_diff is not None
+
+    # not computed by the serialization
+    assert rule.to_json()['fidelity'] is None
+
+    # the next run of the notebook (which overwrites its output) does not affect the pending diff
+    pending_nb = Path(rule.pending_diff['output'])
+    assert pending_nb.parent == rule.pending_nb_dir
+    executed = pending_nb.read_text()
+    output_nb = rule.output_nb_dir / 'tests' / 'Simple_input_output.ipynb'
+    output_nb.write_text('{"cells": [], "metadata": {}, "nbformat": 4, "nbformat_minor": 4}')
+
+    rule.compute_pending_diff()
+    assert rule.pending_diff is None
+    assert not pending_nb.exists()
+    data = rule.to_json()
+    assert isinstance(data['diff'], list)
+
+    pending_nb.write_text(executed)
+    rule.compute_diff(pending_nb)
+    assert data['fidelity'] == rule.fidelity
+
+    # and stored in the cached results
+    cached = rule.load_cached(rule.cache_file(rule.cache_key()), rule.cache_key())
+    assert cached['pending_diff'] is None
+    assert cached['fidelity'] == rule.fidelity
+
+    # and loaded when the run is resumed
+    resumed = NotebookRule(
+        'Simple I/O (deferred diff, resumed)',
+        notebook='tests/Simple_input_output.ipynb',
+        input={'input_file': 'tests/input.csv'},
+        output={'output_file': result_path.as_posix()},
+    )
+    assert resumed.load_results(rule.cache_key())
+    assert resumed.fidelity == data['fidelity'] and resumed.text_diff == data['text_diff']
+    assert resumed.headers == rule.headers and resumed.images == rule.images
+    assert not resumed.load_results('missing')
+
+
+def test_notebook_rule_definition_index(tmp_path, monkeypatch):
+    from nbpipeline.definitions import DefinitionIndex
+    monkeypatch.setattr(Rule, 'definitions', DefinitionIndex(tmp_path / 'definitions.sqlite'))
+    notebook = tmp_path / 'Data_vault_io.ipynb'
+    notebook.write_bytes(Path('tests/Data_vault_io.ipynb').read_bytes())
+
+    rule = NotebookRule('Definition (first)', notebook=notebook.as_posix())
+    inputs, outputs = rule.inputs, rule.outputs
+
+    # the notebook is not read again when unchanged
+    def fail(self):
+        raise AssertionError('The notebook should not be read')
+    monkeypatch.setattr(NotebookRule, 'deduce_io_from_tags', fail)
+    # the warnings are shown again
+    with warns(UserWarning, match='previously stored from this notebook'):
+        rule = NotebookRule('Definition (cached)', notebook=notebook.as_posix())
+    assert (rule.inputs, rule.outputs) == (inputs, outputs)
+
+    # but it is once it changes
+    stat = notebook.stat()
+    os.utime(notebook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    with raises(AssertionError, match='should not be read'):
+        NotebookRule('Definition (changed)', notebook=notebook.as_posix())
+
+
+def test_discover_notebooks(tmp_path, monkeypatch):
+    from nbpipeline.rules import discover_notebooks
+    from nbpipeline.utils import cd
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp', root_dir=tmp_path)
+    notebook = Path('tests/Simple_input_output.ipynb').read_bytes()
+    for path in ['discovered/b/Second.ipynb', 'discovered/a/First_notebook.ipynb', 'discovered/.hidden/Hidden.ipynb',
+                 'discovered/skipped/Skipped.ipynb', 'discovered/a/__Private.ipynb']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_bytes(notebook)
+
+    with cd(tmp_path):
+        discovered = discover_notebooks('.', ignored_dirs={'skipped'}, jobs=2)
+    assert [rule.name for rule in discovered['rules']] == ['First notebook', 'Second']
+    assert [rule.notebook for rule in discovered['rules']] == [
+        'discovered/a/First_notebook.ipynb', 'discovered/b/Second.ipynb'
+    ]
+    assert set(discovered['groups']) == {'discovered/a', 'discovered/b'}
+
+    # once the definitions are in the index, each is read from it once
+    monkeypatch.setattr(Rule, 'rules', {})
+    lookups = []
+    get = Rule.definitions.get
+    monkeypatch.setattr(Rule.definitions, 'get', lambda key: lookups.append(key) or get(key))
+    with cd(tmp_path):
+        rediscovered = discover_notebooks('.', ignored_dirs={'skipped'}, jobs=2)
+    assert len(lookups) == 2
+    assert [rule.inputs for rule in rediscovered['rules']] == [rule.inputs for rule in discovered['rules']]
+
+
+def test_discover_notebooks_spawn(tmp_path):
+    """The worker processes do not rely on the state inherited with fork (the default on Linux only)"""
+    from multiprocessing import get_context
+    from nbpipeline.rules import discover_notebooks
+    from nbpipeline.utils import cd
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp', root_dir=tmp_path)
+    for name in ['Spawned_first', 'Spawned_second']:
+        (tmp_path / 'spawned' / f'{name}.ipynb').parent.mkdir(exist_ok=True)
+        (tmp_path / 'spawned' / f'{name}.ipynb').write_bytes(Path('tests/Data_vault_io.ipynb').read_bytes())
+
+    with cd(tmp_path), warns(UserWarning, match='previously stored from this notebook'):
+        discovered = discover_notebooks('.', jobs=2, mp_context=get_context('spawn'))
+    assert [rule.name for rule in discovered['rules']] == ['Spawned first', 'Spawned second']
+    assert all(rule.definition['warnings'] for rule in discovered['rules'])
+
+
+def test_discover_notebooks_without_index(tmp_path, monkeypatch):
+    from nbpipeline.rules import discover_notebooks
+    from nbpipeline.utils import cd
+    monkeypatch.setattr(Rule, 'definitions', None)
+    for name in ['Data_vault_io', 'Simple_input_output']:
+        (tmp_path / 'discovered' / f'{name}.ipynb').parent.mkdir(exist_ok=True)
+        (tmp_path / 'discovered' / f'{name}.ipynb').write_bytes(Path(f'tests/{name}.ipynb').read_bytes())
+
+    # the notebooks are only read by the worker processes
+    main_process = os.getpid()
+    deduce_io_from_tags = NotebookRule.deduce_io_from_tags
+
+    def deduce_in_worker_only(self):
+        assert os.getpid() != main_process, 'The notebook should not be read again'
+        return deduce_io_from_tags(self)
+    monkeypatch.setattr(NotebookRule, 'deduce_io_from_tags', deduce_in_worker_only)
+
+    # and the warnings from the workers are shown
+    with cd(tmp_path), warns(UserWarning, match='previously stored from this notebook'):
+        discovered = discover_notebooks('.', jobs=2)
+    assert [rule.name for rule in discovered['rules']] == ['Data vault io', 'Simple input output']
+    assert discovered['rules'][0].inputs or discovered['rules'][0].outputs
+
+
+def test_run_magic_relative_to_root(tmp_path, monkeypatch):
+    """The `%run` paths are relative to the root, also once the notebook is run from its own directory"""
+    from nbpipeline import rules
+    from nbpipeline.notebooks import IncludeResolver
+    from nbpipeline.scheduler import execute_rule
+    from nbpipeline.utils import cd
+
+    (tmp_path / 'analyses').mkdir()
+    (tmp_path / 'analyses' / 'helper.ipynb').write_text(NOTEBOOK_TO_INCLUDE)
+    notebook = notebook_with_run_magic('analyses/helper.ipynb')
+    (tmp_path / 'analyses' / 'Main.ipynb').write_text(json.dumps(notebook))
+
+    with cd(tmp_path):
+        Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp')
+        for run in ['first', 'second']:
+            # as if each run was in a new process: the definition comes from the index
+            monkeypatch.setattr(rules, 'outlines', IncludeResolver(read_outline, root=Rule.root_dir))
+            rule = NotebookRule(f'Relative %run ({run})', notebook='analyses/Main.ipynb', execute=False)
+            assert execute_rule(rule, use_cache=False) == 0
+            assert len(rule.notebook_outline['cells']) == 5
+
+
+def test_outdated_included_notebook(tmp_path):
+    from nbpipeline.utils import cd
+    (tmp_path / 'helper.ipynb').write_text(NOTEBOOK_TO_INCLUDE)
+    (tmp_path / 'Main.ipynb').write_text(json.dumps(notebook_with_run_magic('helper.ipynb')))
+    (tmp_path / 'result.csv').write_text('')
+
+    with cd(tmp_path):
+        Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp')
+        rule = NotebookRule('Outdated include', notebook='Main.ipynb', output={'x': 'result.csv'}, deduce_io=False)
+        assert rule.outdated_reason() is None
+
+        stat = (tmp_path / 'helper.ipynb').stat()
+        os.utime(tmp_path / 'helper.ipynb', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        assert rule.outdated_reason() == 'changed included notebook helper.ipynb'
+
+        # also once the definition comes from the index
+        cached = NotebookRule('Outdated include (cached)', notebook='Main.ipynb', output={'x': 'result.csv'}, deduce_io=False)
+        assert cached.includes == [str(tmp_path / 'helper.ipynb')]
+
+
+def test_cached_results_images_on_other_machine(tmp_path):
+    from tests.test_images import PIXEL
+    shared = tmp_path / 'shared_artifacts'
+    Rule.setup(cache_dir=tmp_path / 'first_machine', tmp_dir=tmp_path / 'tmp', artifacts_dir=shared)
+    rule = NotebookRule('Shared images', notebook='tests/Simple_input_output.ipynb', execute=False)
+    digest = Rule.image_store.store(PIXEL)
+    results = {key: None for key in NotebookRule.cached_results}
+    results['images'] = [digest]
+    rule.save_cached(rule.cache_file('key'), 'key', results)
+
+    # the images are restored from the shared store, together with the record
+    Rule.setup(cache_dir=tmp_path / 'second_machine', tmp_dir=tmp_path / 'tmp', artifacts_dir=shared)
+    assert not Rule.image_store.has(digest)
+    assert rule.load_results('key')
+    assert rule.images == [digest] and Rule.image_store.has(digest)
+    assert Rule.image_store.thumbnail_path(digest).exists()
+
+    # if these cannot be restored, the cached results are not used
+    Rule.setup(cache_dir=tmp_path / 'third_machine', tmp_dir=tmp_path / 'tmp', artifacts_dir=shared)
+    for path in (shared / 'objects').rglob('*'):
+        if path.is_file():
+            path.unlink()
+    rule.images = []
+    assert not rule.load_results('key')
+    assert rule.images == []
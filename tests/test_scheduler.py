@@ -0,0 +1,162 @@
+import sys
+
+from nbpipeline.graph import RulesGraph
+from nbpipeline.journal import Journal
+from nbpipeline.rules import ShellRule, Rule, SKIPPED
+from nbpipeline.scheduler import Scheduler
+
+
+TIMESTAMP = f'{sys.executable} -c "import time; print(time.time())"'
+
+
+def slow_command(times_path):
+    """Sleeps, recording the times of the start and of the end in given file"""
+    return f'{TIMESTAMP} > {times_path}; sleep 0.5; {TIMESTAMP} >> {times_path}; touch'
+
+
+def read_times(tmp_path, prefix, name):
+    start, end = (tmp_path / f'{prefix}_{name}.times').read_text().split()
+    return float(start), float(end)
+
+
+def make_rules(tmp_path, prefix):
+    a, b, c = [(tmp_path / f'{prefix}_{name}.txt').as_posix() for name in 'abc']
+    rules = [
+        ShellRule(f'{prefix}: slow a', command=slow_command(tmp_path / f'{prefix}_a.times'), output=a),
+        ShellRule(f'{prefix}: slow b', command=slow_command(tmp_path / f'{prefix}_b.times'), output=b),
+        ShellRule(
+            f'{prefix}: merge',
+            command=f'test -e {a} && test -e {b} && touch {c} && echo',
+            input={'a': a, 'b': b},
+            output={'c': c}
+        )
+    ]
+    return {rule.name: rule for rule in rules}
+
+
+def test_parallel_scheduler(tmp_path, capsys):
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp')
+    rules = make_rules(tmp_path, 'parallel')
+    graph = RulesGraph(rules)
+
+    merge = rules['parallel: merge']
+    assert graph.rule_dependencies()[merge] == {rules['parallel: slow a'], rules['parallel: slow b']}
+
+    statuses = Scheduler(graph, jobs=2).run()
+
+    # both slow rules ran at the same time
+    a_start, a_end = read_times(tmp_path, 'parallel', 'a')
+    b_start, b_end = read_times(tmp_path, 'parallel', 'b')
+    assert a_start < b_end and b_start < a_end
+    assert list(statuses) == graph.iterate_rules()
+    assert all(status == 0 for status in statuses.values())
+    assert (tmp_path / 'parallel_c.txt').exists()
+    # execution time was transferred back from the worker process
+    assert merge.execution_time is not None
+
+
+def test_serial_scheduler(tmp_path):
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp')
+    rules = make_rules(tmp_path, 'serial')
+    statuses = Scheduler(RulesGraph(rules), jobs=1).run()
+    assert all(status == 0 for status in statuses.values())
+    assert (tmp_path / 'serial_c.txt').exists()
+
+    # one after another
+    a_start, a_end = read_times(tmp_path, 'serial', 'a')
+    b_start, b_end = read_times(tmp_path, 'serial', 'b')
+    assert a_end <= b_start or b_end <= a_start
+
+
+def failing_rules(tmp_path, prefix):
+    a, b, c = [(tmp_path / f'{prefix}_{name}.txt').as_posix() for name in 'abc']
+    rules = [
+        ShellRule(f'{prefix}: failing', command='false', output={'': a}),
+        ShellRule(f'{prefix}: downstream', command='touch', input={'a': a}, output={'': b}),
+        ShellRule(f'{prefix}: independent', command='sleep 0.2; touch', output={'': c}),
+    ]
+    return rules
+
+
+def test_failure_propagation(tmp_path):
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp')
+    for jobs in [1, 2]:
+        failing, downstream, independent = failing_rules(tmp_path, f'failure {jobs}')
+        graph = RulesGraph({rule.name: rule for rule in [failing, downstream, independent]})
+        statuses = Scheduler(graph, jobs=jobs).run()
+
+        assert statuses[failing] != 0
+        assert statuses[downstream] is None
+        assert statuses[independent] == 0
+        assert downstream.status == SKIPPED
+        assert downstream.to_json()['skipped_because'] == failing.name
+
+
+def test_fail_fast(tmp_path):
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp')
+    failing, downstream, independent = failing_rules(tmp_path, 'fail fast')
+    graph = RulesGraph({rule.name: rule for rule in [failing, independent, downstream]})
+    statuses = Scheduler(graph, jobs=1, fail_fast=True).run()
+    assert statuses[independent] is None
+    assert not (tmp_path / 'fail fast_c.txt').exists()
+
+
+def test_resume(tmp_path):
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp')
+    journal_path = tmp_path / 'journal.jsonl'
+    first, second = (tmp_path / 'first.txt').as_posix(), (tmp_path / 'second.txt').as_posix()
+    rules = [
+        ShellRule('resume: first', command='echo 1 >', output={'': first}),
+        ShellRule('resume: second', command='false', input={'': first}, output={'': second}),
+    ]
+    rules = {rule.name: rule for rule in rules}
+
+    journal = Journal(journal_path)
+    journal.start_run()
+    Scheduler(RulesGraph(rules), journal=journal).run()
+    journal.close()
+
+    completed = Journal(journal_path).completed_rules(rules)
+    assert list(completed) == [rules['resume: first']]
+
+    # resuming adds to the journal of the interrupted run
+    journal = Journal(journal_path)
+    journal.start_run(resume=True)
+    journal.close()
+    assert list(Journal(journal_path).completed_rules(rules)) == [rules['resume: first']]
+
+    # outputs changed since
+    with open(first, 'w') as f:
+        f.write('2')
+    assert Journal(journal_path).completed_rules(rules) == {}
+
+
+def test_resume_after_upstream_change(tmp_path):
+    Rule.setup(cache_dir=tmp_path / 'cache', tmp_dir=tmp_path / 'tmp')
+    journal_path = tmp_path / 'journal.jsonl'
+    first, second, third = [(tmp_path / f'{name}.txt').as_posix() for name in ['first', 'second', 'third']]
+    rules = [
+        ShellRule('resume upstream: first', command='echo 1 >', output={'': first}),
+        ShellRule('resume upstream: second', command='touch', input={'': first}, output={'': second}),
+        ShellRule('resume upstream: independent', command='touch', output={'': third}),
+    ]
+    first_rule, second_rule, independent = rules
+    graph = RulesGraph({rule.name: rule for rule in rules})
+
+    journal = Journal(journal_path)
+    journal.start_run()
+    Scheduler(graph, journal=journal).run()
+    journal.close()
+    assert set(Journal(journal_path).resumable_rules(graph)) == set(rules)
+
+    # the first rule will run again, so the second has to run again too
+    with open(first, 'w') as f:
+        f.write('2')
+    assert set(Journal(journal_path).completed_rules(graph.rules)) == {second_rule, independent}
+    assert set(Journal(journal_path).resumable_rules(graph)) == {independent}
+
+    # unless the first rule is not going to run
+    assert set(Journal(journal_path).resumable_rules(graph, to_run={second_rule, independent})) == {
+        second_rule, independent
+    }
+    assert set(Journal(journal_path).resumable_rules(graph, forced={independent})) == set()
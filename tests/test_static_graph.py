@@ -0,0 +1,36 @@
+from pytest import importorskip
+
+from nbpipeline.graph import RulesGraph
+from nbpipeline.rules import ShellRule
+
+
+def test_static_graph_cache(tmp_path, monkeypatch):
+    importorskip('pygraphviz')
+    from pygraphviz import AGraph
+    from nbpipeline.visualization.static_graph import static_graph
+
+    rules = [
+        ShellRule('static: first', command='true', output={'a': 'static/a.txt'}),
+        ShellRule('static: second', command='true', input={'a': 'static/a.txt'}),
+    ]
+    graph = RulesGraph({rule.name: rule for rule in rules})
+    cache_dir = tmp_path / 'static_graph'
+
+    svg = static_graph(graph.refresh(), cache_dir=cache_dir)
+    assert '<svg' in svg and 'a:hover polygon' in svg
+    cached = list(cache_dir.glob('*.svg'))
+    assert len(cached) == 1
+
+    def draw(*args, **kwargs):
+        raise AssertionError('the graph should not be rendered again')
+
+    monkeypatch.setattr(AGraph, 'draw', draw)
+    assert static_graph(graph.refresh(), cache_dir=cache_dir) == svg
+
+    # the graph changed: rendered again
+    rules[0].status = 1
+    graph.update(rules[0])
+    monkeypatch.undo()
+    assert '<svg' in static_graph(graph.refresh(), cache_dir=cache_dir)
+    updated = list(cache_dir.glob('*.svg'))
+    assert len(updated) == 1 and updated != cached